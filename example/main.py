@@ -2,12 +2,50 @@ import logging
 import click
 
 from src.southwind import SouthWind
+from src.workers import Coordinator
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
 
-@click.command()
+
+def parse_duration(ctx, param, value: str) -> float:
+    """Parse a duration such as `90s`, `12h` or `30d` into seconds, plain numbers are seconds"""
+    if value is None:
+        return None
+    unit = DURATION_UNITS.get(value[-1:].lower())
+    try:
+        seconds = float(value[:-1]) * unit if unit else float(value)
+    except ValueError:
+        raise click.BadParameter("must be a number with an optional unit of s, m, h or d")
+    if seconds <= 0:
+        raise click.BadParameter("must be positive")
+    return seconds
+
+
+@click.group(invoke_without_command=True)
+@click.option(
+    "--config",
+    help="path to yaml config file, when run without a command",
+    type=click.Path(),
+)
+@click.option(
+    "--workers",
+    help="number of worker processes, when run without a command",
+    type=click.IntRange(min=1),
+    default=1,
+)
+@click.pass_context
+def southwind(ctx: click.Context, config: str, workers: int):
+    # without a command, changes are generated in real time as `run` does
+    if ctx.invoked_subcommand is None:
+        if config is None:
+            config = click.prompt("path to config", type=click.Path(), default="config.yaml")
+        ctx.invoke(run, config=config, workers=workers)
+
+
+@southwind.command()
 @click.option(
     "--config",
     prompt="path to config",
@@ -15,9 +53,50 @@ logger.setLevel(logging.INFO)
     type=click.Path(),
     default="config.yaml",
 )
-def southwind(config: str):
+@click.option(
+    "--workers",
+    help="number of worker processes, each generating changes on its own shard of the database",
+    type=click.IntRange(min=1),
+    default=1,
+)
+def run(config: str, workers: int):
+    click.echo(f"Loading config from {config}")
+    if workers > 1:
+        Coordinator(config, workers).execute()
+    else:
+        SouthWind(config).execute()
+
+
+@southwind.command()
+@click.option(
+    "--config",
+    prompt="path to config",
+    help="path to yaml config file",
+    type=click.Path(),
+    default="config.yaml",
+)
+@click.option(
+    "--events",
+    help="number of events to generate",
+    type=click.IntRange(min=1),
+)
+@click.option(
+    "--duration",
+    help="span of simulated time to generate e.g. 30d, events are paced by the configured rates",
+    callback=parse_duration,
+)
+@click.option(
+    "--start",
+    help="simulated time the history starts at, defaults to the duration before now",
+    type=click.DateTime(),
+)
+def backfill(config: str, events: int, duration: float, start):
+    if events is None and duration is None:
+        raise click.UsageError("Either --events or --duration is required")
     click.echo(f"Loading config from {config}")
-    SouthWind(config).execute()
+    SouthWind(config).backfill(
+        events, duration, start.timestamp() if start else None
+    )
 
 
 if __name__ == "__main__":
@@ -53,17 +53,19 @@ class Action:
 
 
 class Create(Action):
-    """Create action to create a new record in the table"""
+    """Create action to create new records in the table, `batch_size` records at a time"""
 
     REQUIRED_CONFIG_KEYS = Action.REQUIRED_CONFIG_KEYS
-    OPTIONAL_CONFIG_KEYS = Action.OPTIONAL_CONFIG_KEYS
+    OPTIONAL_CONFIG_KEYS = Action.OPTIONAL_CONFIG_KEYS + ["batch_size"]
 
     def __init__(
         self,
         name: str,
         frequency: float,
+        batch_size: int = 1,
     ):
         super().__init__(name, frequency)
+        self.batch_size = batch_size
 
     @classmethod
     def is_valid(self, attribs: Dict, table_name: str = "") -> bool:
@@ -77,6 +79,9 @@ class Create(Action):
         )
         if not (attribs["frequency"] > 0 and attribs["frequency"] <= 1):
             raise InvalidValueError("Frequency must be between 0 and 1")
+        batch_size = attribs.get("batch_size", 1)
+        if not isinstance(batch_size, int) or batch_size < 1:
+            raise InvalidValueError("Batch size must be a positive integer")
         return True
 
 
@@ -0,0 +1,80 @@
+from typing import Dict
+import json
+import os
+
+from .exporter import RollingFile
+
+
+class ExportCheckpoint:
+    """Durable record of how far each table has been exported, kept as `_checkpoint.json` in the output folder.
+    A table's checkpoint only moves once a file is complete, and only as far as every earlier change of the table
+    is in complete files, with the file and the number of records it ended at. Everything up to the checkpoint
+    is then in files readers can see, even while other partitions of the table still have files open.
+    Changes after the checkpoint were either never exported or only made it to an incomplete file,
+    and are exported again from the database on the next start.
+    """
+
+    FILE_NAME = "_checkpoint.json"
+
+    def __init__(self, base_path: str):
+        """Init the checkpoint
+
+        Args:
+            base_path (str): output folder the checkpoint is kept in
+        """
+        self.path = f"{base_path}/{ExportCheckpoint.FILE_NAME}"
+        self.tables: Dict[str, Dict] = {}  # table -> change_token, file, records
+
+    def load(self) -> bool:
+        """Load the checkpoint left by the last run
+
+        Returns:
+            bool: whether there was one
+        """
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r") as checkpoint_file:
+            self.tables = json.load(checkpoint_file)["tables"]
+        return True
+
+    def change_token(self, table_name: str) -> int:
+        """Greatest change token exported for a table, None if none have been"""
+        return self.tables.get(table_name, {}).get("change_token")
+
+    def start(self, table_name: str, change_token: int) -> None:
+        """Start checkpointing a table from a change token, changes up to it count as exported
+
+        Args:
+            table_name (str): table name
+            change_token (int): greatest change token already exported, None for none
+        """
+        self.tables[table_name] = {"change_token": change_token, "file": None, "records": 0}
+
+    def completed(self, table_name: str, file: RollingFile, completed_through: int) -> None:
+        """Move a table's checkpoint on once a file completes and save it
+
+        Args:
+            table_name (str): table the file belongs to
+            file (RollingFile): completed file
+            completed_through (int): change token up to which all of the table's changes are in complete files
+        """
+        change_token = self.change_token(table_name)
+        if completed_through is not None and (
+            change_token is None or completed_through > change_token
+        ):
+            change_token = completed_through
+        self.tables[table_name] = {
+            "change_token": change_token,
+            "file": file.path,
+            "records": file.records,
+        }
+        self.save()
+
+    def save(self) -> None:
+        """Write the checkpoint under a temporary name and rename it into place"""
+        with open(f"{self.path}.tmp", "w") as checkpoint_file:
+            json.dump({"tables": self.tables}, checkpoint_file, indent=2)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(path={self.path}, tables={len(self.tables)})"
@@ -1,12 +1,19 @@
-from typing import List
+from typing import Callable, List, Union
 
 import yaml
 from pathlib import Path
 
 from .exceptions import InvalidConfigSettingError
+from .envelope import DebeziumEnvelope
+from .exporter import Exporter, RollingFile, lz4, zstandard
+from .stream import StreamExporter
 from .table import Table
+from .key_index import KeyIndex
+from .sequence import SequenceAllocator
 from .field import Field
 from .imposter import Imposter, ImposterType
+from .pool import ValuePool
+from .scheduler import RateLimit
 from .action import Create, Remove, Set
 
 
@@ -16,6 +23,7 @@ class Config:
     """
 
     DELETE_BEHAVIOURS = ["HARD", "SOFT"]
+    BACKENDS = ["DUCKDB", "MEMORY"]
 
     def __init__(self, config_path: str):
         """Init class variables and load the config file
@@ -31,26 +39,225 @@ class Config:
             self.db_path = self.config["db_path"]
             self.output_format = self.config["output"]["format"]
             self.output_path = self.config["output"]["path"]
+            self.output_max_bytes = self.config["output"].get(
+                "max_bytes", Exporter.DEFAULT_MAX_BYTES
+            )
+            self.output_max_records = self.config["output"].get("max_records", None)
+            self.output_max_age_ms = self.config["output"].get(
+                "max_age_ms", Exporter.DEFAULT_MAX_AGE_MS
+            )
+            self.output_compression = self.config["output"].get("compression", None)
+            if self.output_compression is not None:
+                self.output_compression = str(self.output_compression).lower()
+            self.output_row_group_size = self.config["output"].get(
+                "row_group_size", 100000
+            )
+            self.output_partition = self.config["output"].get("partition", None)
+            self.output_stream = self.config["output"].get("stream", None)
+            self.output_envelope = self.config["output"].get("envelope", None)
+            if self.output_envelope is not None:
+                self.output_envelope = str(self.output_envelope).lower()
+            if self.output_partition is not None:
+                self.output_partition = str(self.output_partition).lower()
             self.delete_behaviour = self.config["delete_behaviour"].upper()
-            self.inter_action_delay = self.config["inter_action_delay"]
+            self.inter_action_delay = self.config.get("inter_action_delay", 0)
+            self.rate = (
+                RateLimit.from_config(self.config["rate"], "global")
+                if "rate" in self.config
+                else None
+            )
+            self.increment_block_size = self.config.get("increment_block_size", 1)
+            self.create_batch_size = self.config.get("create_batch_size", 1)
+            self.change_batch_size = self.config.get("change_batch_size", 1)
+            self.commit_every_n_actions = self.config.get("commit_every_n_actions", None)
+            self.commit_every_ms = self.config.get("commit_every_ms", None)
+            self.pipeline_queue_size = self.config.get("pipeline_queue_size", 100)
+            self.journal = self.config.get("journal", False)
+            self.checkpoint = self.config.get("checkpoint", True)
+            self.sweep_every_ms = self.config.get("sweep_every_ms", None)
+            self.sweep_threshold = self.config.get("sweep_threshold", None)
+            self.backend = str(self.config.get("backend", "duckdb")).upper()
+            self.snapshot_every_ms = self.config.get("snapshot_every_ms", 10000)
+            self.compact_tombstones = (
+                self.config.get("compact_tombstones", True)
+                and self.delete_behaviour == "SOFT"
+            )
+            self.pool_max_bytes = self.config.get(
+                "pool_max_bytes", ValuePool.DEFAULT_MAX_BYTES
+            )
 
             if self.delete_behaviour not in Config.DELETE_BEHAVIOURS:
                 raise InvalidConfigSettingError(
                     "Invalid delete behaviour, either 'HARD' or 'SOFT'"
                 )
+            if self.output_format.lower() not in Exporter.FORMATS:
+                raise InvalidConfigSettingError(
+                    f"Invalid output format, one of {', '.join(Exporter.FORMATS)}"
+                )
+            if self.output_compression is not None:
+                if self.output_format.lower() == "parquet":
+                    if self.output_compression not in Exporter.PARQUET_COMPRESSIONS:
+                        raise InvalidConfigSettingError(
+                            f"Invalid parquet compression, one of {', '.join(Exporter.PARQUET_COMPRESSIONS)}"
+                        )
+                elif self.output_compression not in Exporter.TEXT_COMPRESSIONS:
+                    raise InvalidConfigSettingError(
+                        f"Invalid compression, one of {', '.join(Exporter.TEXT_COMPRESSIONS)}"
+                    )
+                elif self.output_compression == "zstd" and zstandard is None:
+                    raise InvalidConfigSettingError(
+                        "zstd compression requires the zstandard package"
+                    )
+                elif self.output_compression == "lz4" and lz4 is None:
+                    raise InvalidConfigSettingError(
+                        "lz4 compression requires the lz4 package"
+                    )
+            if (
+                self.output_partition is not None
+                and self.output_partition not in Exporter.PARTITIONS
+            ):
+                raise InvalidConfigSettingError(
+                    "Invalid output partition, either 'day' or 'hour'"
+                )
+            if self.output_envelope is not None:
+                if self.output_envelope not in Exporter.ENVELOPES:
+                    raise InvalidConfigSettingError(
+                        f"Invalid output envelope, one of {', '.join(Exporter.ENVELOPES)}"
+                    )
+                if self.output_format.lower() != "json":
+                    raise InvalidConfigSettingError(
+                        "An output envelope needs json output"
+                    )
+            if self.output_stream is not None:
+                if (
+                    not isinstance(self.output_stream, dict)
+                    or str(self.output_stream.get("type", "")).lower()
+                    not in StreamExporter.TYPES
+                    or not self.output_stream.get("address")
+                ):
+                    raise InvalidConfigSettingError(
+                        f"output stream needs a type, one of {', '.join(StreamExporter.TYPES)}, and an address"
+                    )
+                if self.output_format.lower() != "json":
+                    raise InvalidConfigSettingError("Only json output can be streamed")
+            if self.backend not in Config.BACKENDS:
+                raise InvalidConfigSettingError(
+                    "Invalid backend, either 'duckdb' or 'memory'"
+                )
+            if (
+                not isinstance(self.increment_block_size, int)
+                or self.increment_block_size < 1
+            ):
+                raise InvalidConfigSettingError(
+                    "increment_block_size must be a positive integer"
+                )
+            if not isinstance(self.create_batch_size, int) or self.create_batch_size < 1:
+                raise InvalidConfigSettingError(
+                    "create_batch_size must be a positive integer"
+                )
+            if not isinstance(self.change_batch_size, int) or self.change_batch_size < 1:
+                raise InvalidConfigSettingError(
+                    "change_batch_size must be a positive integer"
+                )
+            if (
+                not isinstance(self.pipeline_queue_size, int)
+                or self.pipeline_queue_size < 1
+            ):
+                raise InvalidConfigSettingError(
+                    "pipeline_queue_size must be a positive integer"
+                )
+            for setting in ["journal", "checkpoint", "compact_tombstones"]:
+                if not isinstance(self.config.get(setting, False), bool):
+                    raise InvalidConfigSettingError(f"{setting} must be true or false")
+            for setting in [
+                "commit_every_n_actions",
+                "commit_every_ms",
+                "sweep_every_ms",
+                "sweep_threshold",
+                "snapshot_every_ms",
+                "output_max_bytes",
+                "output_max_records",
+                "output_max_age_ms",
+                "output_row_group_size",
+            ]:
+                value = getattr(self, setting)
+                if value is not None and (not isinstance(value, int) or value < 1):
+                    raise InvalidConfigSettingError(
+                        f"{setting} must be a positive integer"
+                    )
+
+    def load_exporter(
+        self,
+        tables: List[Table],
+        on_complete: Callable[[str, RollingFile, int], None] = None,
+    ) -> Union[Exporter, StreamExporter]:
+        """Create the exporter for the configured output, streaming when `output.stream` is set
+
+        Args:
+            tables (List[Table]): tables exported, their field types are used for typed formats
+            on_complete (Callable[[str, RollingFile, int], None], optional): called once a file is complete with the table, the file and the change token up to which
+                all of the table's changes are in complete files. Defaults to None.
+
+        Returns:
+            Union[Exporter, StreamExporter]: exporter writing to the output path, or to the output stream
+        """
+        envelope = None
+        if self.output_envelope is not None:
+            envelope = DebeziumEnvelope(
+                Path(self.db_path).stem,
+                {
+                    table.table_name: table.get_pk_field().name
+                    for table in tables
+                    if table.get_pk_field()
+                },
+            )
+        if self.output_stream is not None:
+            return StreamExporter(
+                str(self.output_stream["type"]).lower(),
+                str(self.output_stream["address"]),
+                on_complete,
+                envelope,
+            )
+        return Exporter(
+            self.output_path,
+            self.output_max_bytes,
+            self.output_max_records,
+            self.output_max_age_ms,
+            {
+                table.table_name: {field.name: field.type for field in table.fields}
+                for table in tables
+            },
+            self.output_compression,
+            self.output_row_group_size,
+            self.output_partition,
+            on_complete,
+            envelope,
+        )
 
     def create_output_folders(self, table_names: List[str]):
-        """Generate the output folders for the tables
+        """Generate the output folders for the tables, only the output folder itself when streaming
 
         Args:
             table_names (List[str]): List of table names
         """
+        if self.output_stream is not None:
+            Path(self.output_path).mkdir(parents=True, exist_ok=True)
+            return
         for table_name in table_names:
-            Path(f"{self.output_path}/{table_name}").mkdir(parents=True, exist_ok=True)
+            folder = (
+                f"table={table_name}" if self.output_partition is not None else table_name
+            )
+            Path(f"{self.output_path}/{folder}").mkdir(parents=True, exist_ok=True)
 
-    def load_datasets(self) -> List[Table]:
+    def load_datasets(
+        self, key_index: KeyIndex = None, sequences: SequenceAllocator = None
+    ) -> List[Table]:
         """Load the datasets from the config file
 
+        Args:
+            key_index (KeyIndex, optional): index used by the tables to resolve table_random lookups. Defaults to None.
+            sequences (SequenceAllocator, optional): allocator used by the tables for increment values. Defaults to None.
+
         Returns:
             List[Table]: List of Table objects
         """
@@ -87,6 +294,8 @@ class Config:
                             field.get("is_pk", False),
                             table_name,  # passed so as to provide better error messages
                             field.get("arguments", []),
+                            field.get("pool_size", 0),
+                            self.pool_max_bytes,
                         )
                     )
 
@@ -96,6 +305,7 @@ class Config:
                         Create(
                             action.get("name", None),
                             action.get("frequency", None),
+                            action.get("batch_size", self.create_batch_size),
                         ),
                     )
                 elif Remove.is_valid(action, table_name):
@@ -120,7 +330,21 @@ class Config:
                         )
                     )
 
-            tables.append(Table(table.get("name", None), fields, actions))
+            tables.append(
+                Table(
+                    table.get("name", None),
+                    fields,
+                    actions,
+                    key_index,
+                    sequences,
+                    self.change_batch_size,
+                    (
+                        RateLimit.from_config(table["rate"], f"Table {table_name}")
+                        if "rate" in table
+                        else None
+                    ),
+                )
+            )
 
         self._validate_table_config(tables)
 
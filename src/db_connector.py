@@ -1,4 +1,4 @@
-from typing import List, Union, Dict
+from typing import Any, Iterator, List, Tuple, Union, Dict
 import logging
 
 from pathlib import Path
@@ -32,33 +32,197 @@ class SQLStatement(Statement):
         super().__init__(value)
 
 
-class DirectStatement(Statement):
-    """Represents a direct value to be used in a query"""
+class PreparedStatement(Statement):
+    """Represents a SQL template with `?` placeholders, executed once per parameter row.
+    Parameters may be SQLStatement objects, these are resolved against the database before execution
+    """
 
-    def __init__(self, value: str = None):
+    def __init__(
+        self, value: str = None, params: List[Tuple] = None, table_name: str = None
+    ):
+        self.params = params if params is not None else [()]
+        self.table_name = table_name
         super().__init__(value)
 
 
+class InsertStatement(PreparedStatement):
+    """Insert of one or more rows into a table, returning the inserted rows"""
+
+    def __init__(self, table_name: str, columns: List[str], rows: List[Tuple]):
+        self.columns = columns
+        super().__init__(
+            f"INSERT INTO {table_name} VALUES ({', '.join('?' * len(columns))}) RETURNING *",
+            rows,
+            table_name,
+        )
+
+
+class BulkInsertStatement(Statement):
+    """Insert of a columnar batch of rows, appended to the table in a single statement from a DataFrame,
+    returning the inserted rows unless `returning` is False.
+    Values may be SQLStatement objects, these are resolved against the database before execution
+    """
+
+    def __init__(
+        self, table_name: str, columns: Dict[str, List], returning: bool = True
+    ):
+        self.table_name = table_name
+        self.columns = columns
+        self.relation_name = f"_bulk_insert_{table_name}"
+        super().__init__(
+            f"INSERT INTO {table_name} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {self.relation_name}"
+            + (" RETURNING *" if returning else "")
+        )
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()), []))
+
+
+class BatchUpdateStatement(Statement):
+    """Update applying a block of staged changes in one statement, returning the updated rows.
+    The staged rows are joined to the table on a key field, each carrying the values to set including its own change token
+    """
+
+    def __init__(self, table_name: str, key_field: str, keys: List, columns: Dict[str, List]):
+        self.table_name = table_name
+        self.key_field = key_field
+        self.columns = {"_key": keys, **columns}
+        self.relation_name = f"_batch_update_{table_name}"
+        super().__init__(
+            f"UPDATE {table_name} SET {', '.join(f'{field} = s.{field}' for field in columns)} "
+            f"FROM {self.relation_name} AS s WHERE {table_name}.{key_field} = s._key AND {table_name}.change_type != 'D' RETURNING {table_name}.*"
+        )
+
+    def __len__(self) -> int:
+        return len(self.columns["_key"])
+
+
+class UpdateStatement(PreparedStatement):
+    """Update of the live rows of a table, optionally filtered by a single where condition, returning the updated rows"""
+
+    def __init__(
+        self,
+        table_name: str,
+        assignments: Dict[str, Any],
+        where_field: str = None,
+        where_condition: str = None,
+        where_value: Any = None,
+    ):
+        self.assignments = assignments
+        self.where_field = where_field
+        self.where_condition = where_condition
+        self.where_value = where_value
+
+        template = f"UPDATE {table_name} SET {', '.join(f'{field} = ?' for field in assignments)} WHERE "
+        params = tuple(assignments.values())
+        if where_field is not None:
+            template += f"{table_name}.{where_field} {where_condition} ? AND "
+            params += (where_value,)
+        super().__init__(
+            template + "change_type != 'D' RETURNING *", [params], table_name
+        )
+
+
 class DBConnector:
     def __init__(self, db_path: Path):
         self.db_path = db_path
         self.conn = duckdb.connect(str(db_path))
 
-    def get_latest_rows(self, table_name: str) -> List[Dict]:
-        """Returns the most recently modified row(s)
+    def begin(self) -> None:
+        self.conn.begin()
+
+    def commit(self) -> None:
+        self.conn.commit()
+
+    def rollback(self) -> None:
+        self.conn.rollback()
+
+    def get_live_rows(self, table_name: str, fields: List[str]) -> List[Dict]:
+        """Returns the given fields of all rows not marked as deleted
 
         Args:
-            table_name (str): table name to extract the most recent values from
+            table_name (str): table name to extract the rows from
+            fields (List[str]): fields to select
 
         Returns:
-            List[Dict]: list of most recently modified records
+            List[Dict]: list of live records
         """
-        return (
-            self.conn.sql(
-                f"SELECT * FROM {table_name} where change_token = (select max(change_token) from {table_name})"
+        return self._fetch_rows(
+            self.conn.execute(
+                f"SELECT {', '.join(fields)} FROM {table_name} where change_type != 'D'"
+            )
+        )
+
+    def delete_tombstones(
+        self, table_name: str, key_field: str, keys: List, archive_table: str = None
+    ) -> int:
+        """Hard delete rows marked as deleted, by key, optionally moving them into an archive table first
+
+        Args:
+            table_name (str): table to delete from
+            key_field (str): field identifying the rows
+            keys (List): values of the key field to delete
+            archive_table (str, optional): table the rows are copied to before being deleted. Defaults to None.
+
+        Returns:
+            int: number of rows deleted
+        """
+        condition = f"change_type = 'D' AND {key_field} IN (SELECT UNNEST(?))"
+        if archive_table is not None:
+            logging.info(
+                f"Moving {len(keys)} tombstone(s) from {table_name} to {archive_table}"
+            )
+            self.conn.execute(
+                f"INSERT INTO {archive_table} SELECT * FROM {table_name} WHERE {condition}",
+                (keys,),
+            )
+        else:
+            logging.info(f"Deleting {len(keys)} tombstone(s) from {table_name}")
+        return self.conn.execute(
+            f"DELETE FROM {table_name} WHERE {condition}", (keys,)
+        ).fetchone()[0]
+
+    def iter_rows_since(
+        self, table_name: str, change_token: int = None, vectors_per_chunk: int = 8
+    ) -> Iterator[List[Dict]]:
+        """Stream the rows changed after a change token, in change token order, a chunk at a time.
+        Reads the database, so for the memory backend only holds before any changes are made
+
+        Args:
+            table_name (str): table, or view, to read the rows from
+            change_token (int, optional): rows with a greater change token are returned, None for all rows. Defaults to None.
+            vectors_per_chunk (int, optional): size of each chunk, in DuckDB vectors of 2048 rows. Defaults to 8.
+
+        Yields:
+            List[Dict]: chunk of changed rows
+        """
+        logging.info(f"Reading {table_name} changes after change token {change_token}")
+        result = self.conn.execute(
+            f"SELECT * FROM {table_name} WHERE change_token > ? ORDER BY change_token",
+            (change_token if change_token is not None else -1,),
+        )
+        columns = [column[0] for column in result.description]
+        while True:
+            chunk = result.fetchmany(vectors_per_chunk * duckdb.__standard_vector_size__)
+            if not chunk:
+                return
+            yield [dict(zip(columns, row)) for row in chunk]
+
+    def get_tombstones(self, table_name: str, change_token: int) -> List[Dict]:
+        """Returns the rows marked as deleted up to a change token
+
+        Args:
+            table_name (str): table name
+            change_token (int): greatest change token of the tombstones returned
+
+        Returns:
+            List[Dict]: tombstones
+        """
+        return self._fetch_rows(
+            self.conn.execute(
+                f"SELECT * FROM {table_name} WHERE change_type = 'D' AND change_token <= ?",
+                (change_token,),
             )
-            .to_df()
-            .to_dict(orient="records")
         )
 
     def get_max_change_token(self, table_name: str) -> int:
@@ -68,13 +232,24 @@ class DBConnector:
             table_name (str):  table name to extract the greatest change record token from
 
         Returns:
-            int: max change token value
+            int: max change token value, None if the table is empty
         """
-        return (
-            self.conn.sql(f"SELECT max(change_token) as change_token from {table_name}")
-            .to_df()
-            .to_dict()["change_token"][0]
-        )
+        return self.get_max_values(table_name, ["change_token"])["change_token"]
+
+    def get_max_values(self, table_name: str, fields: List[str]) -> Dict[str, int]:
+        """Select the max of several fields in a single query
+
+        Args:
+            table_name (str): table name
+            fields (List[str]): fields to get the max of
+
+        Returns:
+            Dict[str, int]: max value per field, None if the table is empty
+        """
+        result = self.conn.sql(
+            f"SELECT {', '.join(f'max({field})' for field in fields)} from {table_name}"
+        ).fetchone()
+        return dict(zip(fields, result))
 
     def execute_sql(self, query: str, result_field: str = None) -> Union[Dict, str]:
         """Execute SQL statement and optionally return a specific field
@@ -93,24 +268,104 @@ class DBConnector:
                 return res.to_df().to_dict()
             else:
                 return {}
-        return str(self.conn.sql(query).to_df().to_dict()[result_field][0])
+        return str(res.to_df().to_dict()[result_field][0])
+
+    def resolve(self, statement: SQLStatement) -> Any:
+        """Run the query of a SQLStatement and return the value of its result field
+
+        Args:
+            statement (SQLStatement): statement to resolve
+
+        Returns:
+            Any: value of the result field in the first row
+        """
+        logging.info(f"Resolving query: {statement.value}")
+        res = self.conn.sql(statement.value)
+        return res.fetchone()[res.columns.index(statement.result_field)]
+
+    def _fetch_rows(self, result: duckdb.DuckDBPyConnection) -> List[Dict]:
+        """Rows returned by an executed statement, empty for statements that don't return any.
+        Built from the fetched tuples rather than a DataFrame, which is faster and keeps NULLs as None rather than NaN
+        """
+        if result.description is None:
+            return []
+        columns = [column[0] for column in result.description]
+        return [dict(zip(columns, row)) for row in result.fetchall()]
+
+    def execute_prepared(self, statement: PreparedStatement) -> List[Dict]:
+        """Execute a prepared statement once per parameter row, collecting the rows it returns.
+        Every prepared statement returns the rows it changes to be exported, which executemany can't do
+        as it only returns the result of the last row, inserts of several rows are a BulkInsertStatement instead
+
+        Args:
+            statement (PreparedStatement): statement to execute
+
+        Returns:
+            List[Dict]: rows returned by the statement
+        """
+        params = [
+            tuple(
+                self.resolve(value) if isinstance(value, SQLStatement) else value
+                for value in row
+            )
+            for row in statement.params
+        ]
+        logging.info(f"Executing query: {statement.value} - {len(params)} row(s)")
+        rows = []
+        for row in params:
+            rows.extend(self._fetch_rows(self.conn.execute(statement.value, row)))
+        return rows
+
+    def execute_columnar(
+        self, statement: Union[BulkInsertStatement, BatchUpdateStatement]
+    ) -> List[Dict]:
+        """Execute a statement reading from a columnar batch, the batch is registered as a DataFrame relation
+
+        Args:
+            statement (Union[BulkInsertStatement, BatchUpdateStatement]): statement to execute
+
+        Returns:
+            List[Dict]: rows returned by the statement
+        """
+        columns = {
+            name: [
+                self.resolve(value) if isinstance(value, SQLStatement) else value
+                for value in values
+            ]
+            for name, values in statement.columns.items()
+        }
+        logging.info(f"Executing query: {statement.value} - {len(statement)} row(s)")
+        import pandas as pd  # only needed here, importing it is most of the cost of starting up
+
+        self.conn.register(statement.relation_name, pd.DataFrame(columns))
+        try:
+            return self._fetch_rows(self.conn.execute(statement.value))
+        finally:
+            self.conn.unregister(statement.relation_name)
+
+    def snapshot_due(self) -> bool:
+        """Whether state held outside the database is due to be written to it, never the case for DuckDB itself"""
+        return False
+
+    def snapshot(self) -> None:
+        """Write any state held outside the database to it, nothing to do for DuckDB itself"""
 
-    def execute(self, statements: List[Statement]) -> Union[Dict, str]:
-        """Execute a list of statements
+    def execute(self, statements: List[Statement]) -> List[Dict]:
+        """Execute a list of statements, capturing the rows they change
 
         Args:
             statements (List[Statement]): List of statements to execute
 
         Returns:
-            _type_: _description_
+            List[Dict]: rows changed by the statements, in change token order
         """
-        final_result = ""
+        changed_rows = []
         for statement in statements:
-            if isinstance(statement, SQLStatement):
-                final_result += self.execute_sql(
-                    statement.value, statement.result_field
-                )
-            elif isinstance(statement, DirectStatement):
-                final_result += str(statement.value)
-        logging.info(f"Executing query: {final_result}")
-        return self.execute_sql(final_result)
+            if isinstance(statement, PreparedStatement):
+                changed_rows.extend(self.execute_prepared(statement))
+            elif isinstance(statement, (BulkInsertStatement, BatchUpdateStatement)):
+                changed_rows.extend(self.execute_columnar(statement))
+            elif isinstance(statement, SQLStatement):
+                self.execute_sql(statement.value)
+        changed_rows.sort(key=lambda row: row["change_token"])
+        return changed_rows
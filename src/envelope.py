@@ -0,0 +1,90 @@
+from typing import Any, Dict, List
+from datetime import datetime
+import time
+
+
+class DebeziumEnvelope:
+    """Wraps exported rows in Debezium style change events,
+    `{"before", "after", "op", "ts_ms", "source": {"connector", "db", "table", "lsn", "ts_ms"}}`.
+    Before images come from an in memory copy of the latest exported image of each row, keyed by the table's
+    primary key, so no queries are made for them. Tables without a primary key have no before images.
+    Rows are wrapped as they're exported, in commit order, so rolled back changes never reach the images.
+    """
+
+    OPS = {"I": "c", "U": "u", "D": "d"}  # change_type -> Debezium op
+
+    def __init__(self, db_name: str, key_fields: Dict[str, str]):
+        """Init the envelope
+
+        Args:
+            db_name (str): database name reported as the source of the events
+            key_fields (Dict[str, str]): primary key per table, tables without one are left out
+        """
+        self.db_name = db_name
+        self.key_fields = key_fields
+        self.images: Dict[str, Dict[Any, Dict]] = {table: {} for table in key_fields}
+
+    def track(self, table_name: str, rows: List[Dict]) -> None:
+        """Load the current images of a table's live rows, as the before images of their next changes
+
+        Args:
+            table_name (str): table name
+            rows (List[Dict]): live rows of the table
+        """
+        key_field = self.key_fields.get(table_name)
+        if key_field is not None:
+            self.images[table_name] = {row[key_field]: _image(row) for row in rows}
+
+    def wrap(self, table_name: str, rows: List[Dict]) -> List[Dict]:
+        """Wrap changed rows in change events, in the order they were made
+
+        Args:
+            table_name (str): table the rows belong to
+            rows (List[Dict]): changed rows
+
+        Returns:
+            List[Dict]: one change event per row
+        """
+        key_field = self.key_fields.get(table_name)
+        images = self.images.get(table_name)
+        ts_ms = int(time.time() * 1000)
+        events = []
+        for row in rows:
+            after = _image(row)
+            op = DebeziumEnvelope.OPS.get(row.get("change_type"), "u")
+            before = None
+            if key_field is not None:
+                if op == "d":
+                    before = images.pop(row[key_field], None)
+                else:
+                    before = images.get(row[key_field])
+                    images[row[key_field]] = after
+            timestamp = row.get("event_timestamp")
+            events.append(
+                {
+                    "before": before,
+                    "after": None if op == "d" else after,
+                    "op": op,
+                    "ts_ms": ts_ms,
+                    "source": {
+                        "connector": "southwind",
+                        "db": self.db_name,
+                        "table": table_name,
+                        "lsn": row.get("change_token"),
+                        "ts_ms": (
+                            int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+                            if isinstance(timestamp, str)
+                            else ts_ms
+                        ),
+                    },
+                }
+            )
+        return events
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(db={self.db_name}, tables={list(self.key_fields)})"
+
+
+def _image(row: Dict) -> Dict:
+    """Image of a row as stored"""
+    return {field: value for field, value in row.items() if field != "event_timestamp"}
@@ -1,46 +1,432 @@
-from typing import List, Dict
+from typing import Callable, List, Dict, Tuple
+from datetime import datetime, timezone
+import gzip
+import io
+import itertools
+import json
+import os
 import time
 import csv
+import duckdb
 import jsonlines
 
+from .envelope import DebeziumEnvelope
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for zstd compressed output
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:  # optional, only needed for lz4 compressed output
+    lz4 = None
+
+
+class RollingFile:
+    """Export file of a table, written under a temporary name and renamed into place once complete,
+    so readers only ever see whole files.
+    Compressed files are compressed as they're written, through a gzip, zstd or lz4 stream
+    """
+
+    def __init__(self, path: str, format: str, compression: str = None):
+        """Open the file
+
+        Args:
+            path (str): final path of the file
+            format (str): export format, either 'json' or 'csv'
+            compression (str, optional): either 'gzip', 'zstd' or 'lz4', None for uncompressed. Defaults to None.
+        """
+        self.path = path
+        self.temp_path = f"{path}.tmp"
+        self.format = format
+        self.records = 0
+        self.min_change_token = None
+        self.max_change_token = None
+        self.tombstones: List[Dict] = []  # deleted rows in the file, swept once it's complete
+        self.opened = time.monotonic()
+
+        self._raw = open(self.temp_path, "wb")
+        if compression == "gzip":
+            stream = gzip.GzipFile(fileobj=self._raw, mode="wb")
+        elif compression == "zstd":
+            stream = zstandard.ZstdCompressor().stream_writer(self._raw)
+        elif compression == "lz4":
+            stream = lz4.frame.LZ4FrameFile(self._raw, mode="wb")
+        else:
+            stream = self._raw
+        self._file = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        self._writer = jsonlines.Writer(self._file) if format == "json" else None
+
+    @property
+    def bytes(self) -> int:
+        """Bytes written to disk so far, after compression"""
+        return self._raw.tell()
+
+    def write(self, values: List[Dict], changes: List[Dict] = None) -> None:
+        """Append records to the file
+
+        Args:
+            values (List[Dict]): records to write
+            changes (List[Dict], optional): changed rows the records were made from, for their change tokens. Defaults to the records.
+        """
+        if self.format == "json":
+            self._writer.write_all(values)
+        else:
+            if self._writer is None:
+                self._writer = csv.DictWriter(
+                    self._file, fieldnames=values[0].keys(), quoting=csv.QUOTE_ALL
+                )
+                self._writer.writeheader()
+            self._writer.writerows(values)
+        self._count(changes or values)
+
+    def _count(self, changes: List[Dict]) -> None:
+        self.records += len(changes)
+        self.tombstones.extend(row for row in changes if row.get("change_type") == "D")
+        tokens = [row["change_token"] for row in changes if "change_token" in row]
+        if tokens:
+            low, high = int(min(tokens)), int(max(tokens))
+            if self.min_change_token is None or low < self.min_change_token:
+                self.min_change_token = low
+            if self.max_change_token is None or high > self.max_change_token:
+                self.max_change_token = high
+
+    def close(self) -> None:
+        """Close the file and atomically rename it to its final path"""
+        self._file.close()
+        if not self._raw.closed:
+            self._raw.close()
+        os.replace(self.temp_path, self.path)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(path={self.path}, records={self.records})"
+
+
+class ParquetFile(RollingFile):
+    """Parquet export file of a table. Records are buffered in memory and written in one go when the file is closed,
+    using DuckDB's COPY, with each column cast to the type of its field
+    """
+
+    def __init__(
+        self,
+        path: str,
+        conn: duckdb.DuckDBPyConnection,
+        column_types: Dict[str, str],
+        compression: str = None,
+        row_group_size: int = 100000,
+    ):
+        """Start the file
+
+        Args:
+            path (str): final path of the file
+            conn (duckdb.DuckDBPyConnection): connection used to write the file
+            column_types (Dict[str, str]): type per field, other columns are written as strings
+            compression (str, optional): parquet compression codec. Defaults to snappy.
+            row_group_size (int, optional): max rows per row group. Defaults to 100000.
+        """
+        self.path = path
+        self.temp_path = f"{path}.tmp"
+        self.format = "parquet"
+        self.records = 0
+        self.min_change_token = None
+        self.max_change_token = None
+        self.tombstones: List[Dict] = []  # deleted rows in the file, swept once it's complete
+        self.opened = time.monotonic()
+        self.conn = conn
+        self.column_types = column_types
+        self.compression = compression or "snappy"
+        self.row_group_size = row_group_size
+
+        self._rows: List[Dict] = []
+        self._bytes = 0
+
+    @property
+    def bytes(self) -> int:
+        """Estimated size of the buffered records, before compression"""
+        return self._bytes
+
+    def write(self, values: List[Dict], changes: List[Dict] = None) -> None:
+        for row in values:
+            self._rows.append(row)
+            self._bytes += sum(len(str(value)) for value in row.values())
+        self._count(changes or values)
+
+    def close(self) -> None:
+        import pandas as pd  # only needed for parquet, importing it is most of the cost of starting up
+
+        columns = list(self._rows[0]) if self._rows else list(self.column_types)
+        self.conn.register(
+            "_export",
+            pd.DataFrame(
+                {
+                    column: pd.Series([row.get(column) for row in self._rows], dtype=object)
+                    for column in columns
+                }
+            ),
+        )
+        casts = [
+            f"CAST({column} AS {self.column_types.get(column, 'string')}) AS {column}"
+            for column in columns
+        ]
+        try:
+            self.conn.execute(
+                f"COPY (SELECT {', '.join(casts)} FROM _export) "
+                f"TO '{self.temp_path}' (FORMAT PARQUET, COMPRESSION {self.compression}, ROW_GROUP_SIZE {self.row_group_size})"
+            )
+        finally:
+            self.conn.unregister("_export")
+        self._rows = []
+        os.replace(self.temp_path, self.path)
+
 
 class Exporter:
-    def __init__(self, base_path: str):
+    """Writes the changes of each table to rolling files, appending to the current file of a table
+    until it reaches `max_bytes`, `max_records` or `max_age_ms`, then starting a new one.
+    Files are named `<table>_<timestamp>_<n>.<format>`, written with a `.tmp` suffix and renamed once rotated,
+    `close` rotates all open files.
+    Parquet files are typed by the `schemas` of the tables, with a row group of up to `row_group_size` rows.
+    When partitioned by `day` or `hour`, files go under `table=<table>/dt=<YYYY-MM-DD>[/hour=<HH>]` by the event time
+    of each record, its `event_timestamp` or the time it's exported, and each partition keeps a manifest
+    of its completed files.
+    With an `envelope`, each row is written as a change event with the before and after images of the row
+    """
+
+    FORMATS = ["json", "csv", "parquet"]
+    PARQUET_COMPRESSIONS = ["snappy", "zstd", "gzip", "uncompressed"]
+    TEXT_COMPRESSIONS = {"gzip": "gz", "zstd": "zst", "lz4": "lz4"}  # compression -> file extension
+    PARTITIONS = ["day", "hour"]
+    ENVELOPES = ["debezium"]
+    MANIFEST = "_manifest.json"
+
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+    DEFAULT_MAX_AGE_MS = 60000
+
+    def __init__(
+        self,
+        base_path: str,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_records: int = None,
+        max_age_ms: int = DEFAULT_MAX_AGE_MS,
+        schemas: Dict[str, Dict[str, str]] = None,
+        compression: str = None,
+        row_group_size: int = 100000,
+        partition: str = None,
+        on_complete: Callable[[str, RollingFile, int], None] = None,
+        envelope: DebeziumEnvelope = None,
+    ):
+        """Init the exporter
+
+        Args:
+            base_path (str): folder the table folders are in
+            max_bytes (int, optional): max size of a file. Defaults to DEFAULT_MAX_BYTES.
+            max_records (int, optional): max number of records in a file. Defaults to None.
+            max_age_ms (int, optional): max time a file is written to in milliseconds. Defaults to DEFAULT_MAX_AGE_MS.
+            schemas (Dict[str, Dict[str, str]], optional): field types per table, used to type parquet columns. Defaults to None.
+            compression (str, optional): compression codec, gzip, zstd or lz4 for text formats, a parquet codec for parquet. Defaults to None.
+            row_group_size (int, optional): max rows per parquet row group. Defaults to 100000.
+            partition (str, optional): partition files by event time, either 'day' or 'hour', None for a flat folder per table. Defaults to None.
+            on_complete (Callable[[str, RollingFile, int], None], optional): called once a file is complete with the table, the file and the change token up to which
+                all of the table's changes are in complete files. Defaults to None.
+            envelope (DebeziumEnvelope, optional): wraps rows in change events before they're written, None to write rows as they are. Defaults to None.
+        """
         self.base_path = base_path
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.max_age_ms = max_age_ms
+        self.schemas = schemas or {}
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.partition = partition
+        self.on_complete = on_complete
+        self.envelope = envelope
+        self._files: Dict[Tuple[str, str], RollingFile] = {}  # (table, partition) -> open file
+        self._conn = None  # connection writing parquet files, opened when first needed
+        self._sequence = itertools.count()  # keeps names unique when files open within the same timestamp
 
     def export(self, table_name: str, values: List[Dict], format: str) -> None:
-        """_summary_
+        """Append records to the current file of a table, rotating it once full
 
         Args:
             table_name (str): table name (used as file partition)
             values (List[Dict]): list of dictionaries to export to target format
-            format (str): export format, either 'json' or 'csv'
+            format (str): export format, either 'json', 'csv' or 'parquet'
 
         Raises:
             NotImplementedError: If not a valid export format
         """
-        if format.lower() == "json":
-            self._export_json(self.base_path, table_name, values)
-        elif format.lower() == "csv":
-            self._export_csv(self.base_path, table_name, values)
-        else:
+        format = format.lower()
+        if format not in Exporter.FORMATS:
             raise NotImplementedError()
+        if not values:
+            return
+
+        self.rotate_expired()
+        for partition, rows in self._partitions(values).items():
+            key = (table_name, partition)
+            file = self._files.get(key)
+            if file is None:
+                file = self._files[key] = self._open(table_name, partition, format)
+            if self.envelope is not None:
+                file.write(self.envelope.wrap(table_name, rows), rows)
+            else:
+                file.write(rows)
+            if self._full(file):
+                self._rotate(key)
 
-    def _export_json(self, base_path: str, table_name: str, values: List[Dict]) -> None:
-        with jsonlines.open(
-            f"{base_path}/{table_name}/{table_name}_{str(time.time()).replace('.', '').ljust(17, '0')}.json",
-            "w",
-        ) as f:
-            f.write_all(values)
-
-    def _export_csv(self, base_path: str, table_name: str, values: List[Dict]) -> None:
-        with open(
-            f"{base_path}/{table_name}/{table_name}_{str(time.time()).replace('.', '').ljust(17, '0')}.csv",
-            "w",
-            newline="",
-        ) as f:
-            writer = csv.DictWriter(
-                f, fieldnames=values[0].keys(), quoting=csv.QUOTE_ALL
+    def _partitions(self, values: List[Dict]) -> Dict[str, List[Dict]]:
+        """Group records by the partition of their event time, keeping their order"""
+        if self.partition is None:
+            return {"": values}
+        now = datetime.now(timezone.utc)
+        partitions: Dict[str, List[Dict]] = {}
+        for row in values:
+            timestamp = row.get("event_timestamp")
+            event_time = (
+                datetime.fromisoformat(timestamp).astimezone(timezone.utc)
+                if isinstance(timestamp, str)
+                else now
             )
-            writer.writeheader()
-            writer.writerows(values)
+            partition = f"dt={event_time:%Y-%m-%d}"
+            if self.partition == "hour":
+                partition += f"/hour={event_time:%H}"
+            partitions.setdefault(partition, []).append(row)
+        return partitions
+
+    def table_path(self, table_name: str) -> str:
+        """Folder the files of a table are written to
+
+        Args:
+            table_name (str): table name
+
+        Returns:
+            str: `<base_path>/<table>`, or `<base_path>/table=<table>` when partitioned
+        """
+        if self.partition is None:
+            return f"{self.base_path}/{table_name}"
+        return f"{self.base_path}/table={table_name}"
+
+    def _open(self, table_name: str, partition: str, format: str) -> RollingFile:
+        folder = self.table_path(table_name)
+        if partition:
+            folder += f"/{partition}"
+            os.makedirs(folder, exist_ok=True)
+        path = self._file_path(folder, table_name, format)
+        if format != "parquet":
+            return RollingFile(path, format, self.compression)
+        if self._conn is None:
+            self._conn = duckdb.connect()
+        return ParquetFile(
+            path,
+            self._conn,
+            self.schemas.get(table_name, {}),
+            self.compression,
+            self.row_group_size,
+        )
+
+    def _file_path(self, folder: str, table_name: str, format: str) -> str:
+        timestamp = str(time.time()).replace(".", "").ljust(17, "0")
+        extension = format
+        if format != "parquet" and self.compression is not None:
+            extension += f".{Exporter.TEXT_COMPRESSIONS[self.compression]}"
+        return f"{folder}/{table_name}_{timestamp}_{next(self._sequence)}.{extension}"
+
+    def _full(self, file: RollingFile) -> bool:
+        return (self.max_bytes is not None and file.bytes >= self.max_bytes) or (
+            self.max_records is not None and file.records >= self.max_records
+        )
+
+    def _expired(self, file: RollingFile) -> bool:
+        return (
+            self.max_age_ms is not None
+            and (time.monotonic() - file.opened) * 1000 >= self.max_age_ms
+        )
+
+    def rotate(self, table_name: str) -> None:
+        """Complete the current files of a table, the next records start new ones
+
+        Args:
+            table_name (str): table name
+        """
+        for key in list(self._files):
+            if key[0] == table_name:
+                self._rotate(key)
+
+    def _rotate(self, key: Tuple[str, str]) -> None:
+        file = self._files.pop(key, None)
+        if file is None:
+            return
+        file.close()
+        if key[1]:
+            self._add_to_manifest(key[0], key[1], file)
+        if self.on_complete is not None:
+            self.on_complete(key[0], file, self._completed_through(key[0], file))
+
+    def _completed_through(self, table_name: str, file: RollingFile) -> int:
+        """Greatest change token up to which all of a table's changes are in complete files, once a file completes.
+        Changes are written in change token order, so while other partitions of the table have files open,
+        everything before the first change in any of them is complete
+        """
+        open_tokens = [
+            open_file.min_change_token
+            for (name, _), open_file in self._files.items()
+            if name == table_name and open_file.min_change_token is not None
+        ]
+        if open_tokens:
+            return min(open_tokens) - 1
+        return file.max_change_token
+
+    def _add_to_manifest(self, table_name: str, partition: str, file: RollingFile) -> None:
+        """Add a completed file to the manifest of its partition.
+        The manifest is rewritten under a temporary name and renamed, like the files it lists
+        """
+        folder = os.path.dirname(file.path)
+        path = f"{folder}/{Exporter.MANIFEST}"
+        if os.path.exists(path):
+            with open(path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+        else:
+            manifest = {
+                "table": table_name,
+                "partition": dict(part.split("=", 1) for part in partition.split("/")),
+                "files": [],
+            }
+        manifest["files"].append(
+            {
+                "file": os.path.basename(file.path),
+                "format": file.format,
+                "records": file.records,
+                "bytes": os.path.getsize(file.path),
+                "min_change_token": file.min_change_token,
+                "max_change_token": file.max_change_token,
+                "completed_at": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            }
+        )
+        with open(f"{path}.tmp", "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(f"{path}.tmp", path)
+
+    def discard_incomplete(self) -> int:
+        """Remove the temporary files left behind by a run that didn't shut down cleanly
+
+        Returns:
+            int: number of files removed
+        """
+        removed = 0
+        for folder, _, file_names in os.walk(self.base_path):
+            for file_name in file_names:
+                if file_name.endswith(".tmp"):
+                    os.remove(os.path.join(folder, file_name))
+                    removed += 1
+        return removed
+
+    def rotate_expired(self) -> None:
+        """Complete any files open for longer than `max_age_ms`"""
+        for key, file in list(self._files.items()):
+            if self._expired(file):
+                self._rotate(key)
+
+    def close(self) -> None:
+        """Complete all open files"""
+        for key in list(self._files):
+            self._rotate(key)
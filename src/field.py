@@ -1,14 +1,22 @@
 from typing import Dict
 from .imposter import Imposter
+from .pool import ValuePool
 
 from .exceptions import InvalidValueError, validate_keys
 
 
 
+def _to_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.lower() == "true"
+    return bool(value)
+
+
 class Field:
     VALID_FIELD_TYPES = ["string", "int", "float", "boolean"]
+    TYPE_CASTS = {"string": str, "int": int, "float": float, "boolean": _to_bool}
 
-    def __init__(self, name: str, type: str, imposter: str, is_pk: bool = False, table: str = '', arguments: list = []) -> None:
+    def __init__(self, name: str, type: str, imposter: str, is_pk: bool = False, table: str = '', arguments: list = [], pool_size: int = 0, pool_max_bytes: int = ValuePool.DEFAULT_MAX_BYTES) -> None:
         """A field is a column in a table.
 
         Args:
@@ -17,6 +25,9 @@ class Field:
             imposter (str): imposter method to generate data for the field e.g. `imposter.name()`
             is_pk (bool, optional): whether a primary key. Defaults to False.
             table (str, optional): _description_. Defaults to ''.
+            arguments (list, optional): arguments passed to the imposter method. Defaults to [].
+            pool_size (int, optional): number of values to pre-generate, 0 to generate on demand. Defaults to 0.
+            pool_max_bytes (int, optional): memory cap of the pre-generated values. Defaults to ValuePool.DEFAULT_MAX_BYTES.
 
         Raises:
             InvalidValueError: _description_
@@ -26,19 +37,31 @@ class Field:
         self.is_pk = is_pk
         if Imposter.is_type(imposter) == False:
             raise InvalidValueError(f"Imposter value `{imposter}` is invalid for field `{name}` in table `{table}`")
-        self.imposter = Imposter(imposter, arguments)
+        self.imposter = Imposter(imposter, arguments, pool_size, pool_max_bytes)
+        self._cast = Field.TYPE_CASTS.get(type, str)
 
 
     def evaluate(self):
         return self.imposter.evaluate()
 
+    def evaluate_batch(self, n: int):
+        return self.imposter.evaluate_batch(n)
+
+    def cast(self, value):
+        """Cast a generated value to the python type matching the field type"""
+        if value is None:
+            return None
+        return self._cast(value)
+
     @classmethod
     def is_valid(self, attribs: Dict, table_name: str):
-        validate_keys(attribs, ["name", "type", "value"], ["is_pk", "arguments"], f"Table: {table_name} - Field: {attribs.get('name', '')}")
+        validate_keys(attribs, ["name", "type", "value"], ["is_pk", "arguments", "pool_size"], f"Table: {table_name} - Field: {attribs.get('name', '')}")
         if attribs["type"] not in Field.VALID_FIELD_TYPES:
             raise InvalidValueError(f"Field type must be string, int, float, or bool - got {attribs["type"]}")
         if Imposter.is_type(attribs["value"]) == False:
             raise InvalidValueError("Imposter value is invalid")
+        if not isinstance(attribs.get("pool_size", 0), int) or attribs.get("pool_size", 0) < 0:
+            raise InvalidValueError(f"pool_size must be a non-negative integer - Table: {table_name} - Field: {attribs['name']}")
         return True
 
     def __str__(self):
@@ -1,20 +1,117 @@
-from typing import Dict, List
+from typing import Any, Callable, Dict, List
 from enum import Enum
 import ast
+import functools
+import itertools
 import random
 import time
 import re
 
-from faker import Faker
-import faker_commerce
-
 from .exceptions import InvalidValueError
+from .pool import ValuePool
 
 
-fake = Faker("en_US")
-fake.add_provider(faker_commerce.Provider)
 random.seed(int(time.time()))
-Faker.seed(random.randint(0, 10000))
+_fake = None  # Faker instance, loaded the first time a faker method is needed
+_faker_seed = random.randint(0, 10000)
+_pools = itertools.count()  # imposters with a pool, each pool is seeded from the position of its imposter
+_pool_fakes = {}  # pool seed -> Faker, in the process generating pool values
+
+
+def _new_fake():
+    """Create a Faker instance, importing Faker and loading its providers on first use,
+    which is most of the cost of starting up
+
+    Returns:
+        Faker: en_US Faker with the commerce provider added
+    """
+    from faker import Faker
+    import faker_commerce
+
+    fake = Faker("en_US")
+    fake.add_provider(faker_commerce.Provider)
+    return fake
+
+
+def get_fake():
+    """Faker instance faker methods are called on, shared by all imposters without a value pool
+
+    Returns:
+        Faker: en_US Faker with the commerce provider added
+    """
+    global _fake
+    if _fake is None:
+        fake = _new_fake()
+        type(fake).seed(_faker_seed)
+        _fake = fake
+    return _fake
+
+
+def get_pool_fake(pool_seed: str):
+    """Faker instance of its own for a value pool, so each pool's values follow its seed whichever pools are refilled first.
+    Created once per pool in the process generating pool values
+
+    Args:
+        pool_seed (str): seed of the pool's values
+
+    Returns:
+        Faker: en_US Faker with the commerce provider added
+    """
+    fake = _pool_fakes.get(pool_seed)
+    if fake is None:
+        fake = _new_fake()
+        fake.seed_instance(pool_seed)
+        _pool_fakes[pool_seed] = fake
+    return fake
+
+
+def _faker_method(fake, value: str) -> Callable:
+    """Look up a faker method
+
+    Args:
+        fake (Faker): Faker instance to look the method up on
+        value (str): imposter value naming the method e.g. `fake.name`
+
+    Raises:
+        InvalidValueError: If Faker has no such method
+
+    Returns:
+        Callable: bound faker method
+    """
+    try:
+        return getattr(fake, value.replace("fake.", ""))
+    except AttributeError:
+        raise InvalidValueError(
+            f"Imposter value must be valid faker method, got - {value}"
+        ) from None
+
+
+def _generate_pool_batch(pool_seed: str, value: str, arguments: List, n: int) -> List[Any]:
+    """Generate a batch of values for a value pool, run in the process generating pool values
+
+    Args:
+        pool_seed (str): seed of the pool's values
+        value (str): imposter value naming the faker method
+        arguments (List): parsed arguments of the faker method
+        n (int): number of values
+
+    Returns:
+        List[Any]: generated values
+    """
+    method = _faker_method(get_pool_fake(pool_seed), value)
+    return [method(*arguments) for _ in range(n)]
+
+
+def seed(value: int) -> None:
+    """Seed the values of faker methods, applied when Faker is loaded if it isn't yet and to the value pools created after
+
+    Args:
+        value (int): seed
+    """
+    global _faker_seed
+    _faker_seed = value
+    if _fake is not None:
+        type(_fake).seed(value)
 
 
 class ImposterResult:
@@ -83,6 +180,7 @@ class Imposter:
     INCREMENT_REGEX_CHECK = r"increment"
     TABLE_RANDOM_REGEX_EXTRACT = r"table_random\(.*?, *.*?, *.*?\)"
     TABLE_RANDOM_REGEX_CHECK = r"table_random\((.*?), *(.*?), *(.*?)\)"
+    FAKER_REGEX_CHECK = r"(fake\.)?[A-Za-z]\w*$"
 
     STATIC_LOOKUP = {
         "true": True,
@@ -91,9 +189,18 @@ class Imposter:
         "None": None,
     }
 
-    def __init__(self, value: str, arguments: List[str | int] = []) -> None:
+    def __init__(
+        self,
+        value: str,
+        arguments: List[str | int] = [],
+        pool_size: int = 0,
+        pool_max_bytes: int = ValuePool.DEFAULT_MAX_BYTES,
+    ) -> None:
         self.value = value
         self.arguments = arguments
+        self.pool_size = pool_size
+        self.pool_max_bytes = pool_max_bytes
+        self.pool = None
         if self.is_type(value) == False:
             raise InvalidValueError("Imposter value must be valid faker method")
 
@@ -104,13 +211,26 @@ class Imposter:
 
         if self.is_static(self.value):
             self.imposter_type = ImposterType.STATIC
-        if self.is_increment(self.value):
+        elif self.is_increment(self.value):
             self.imposter_type = ImposterType.INCREMENT
-        if self.is_table_random(self.value):
+        elif self.is_table_random(self.value):
             self.imposter_type = ImposterType.TABLE_RANDOM
         else:
             self.imposter_type = ImposterType.FAKER
 
+        if self.pool_size and self.imposter_type != ImposterType.FAKER:
+            raise InvalidValueError(
+                f"pool_size is only supported for faker methods, got - {value}"
+            )
+
+        # pools are seeded in the order their imposters are created, so the values they draw follow the seed as well
+        if self.pool_size:
+            self._pool_seed = f"{_faker_seed}:{next(_pools)}"
+
+        # results for custom methods never change between calls, faker results do
+        self._constant = None
+        self._generator = self._compile()
+
     def _eval_static(self) -> ImposterDirectResult:
         match = re.match(Imposter.STATIC_REGEX_CHECK, self.value)
         if not match:
@@ -140,7 +260,12 @@ class Imposter:
         else:
             raise InvalidValueError(f"Invalid table_random value - {self.value}")
 
-    def _eval_faker(self) -> ImposterDirectResult:
+    def _parse_arguments(self) -> List:
+        """Parse the configured arguments into the values passed to the faker method
+
+        Returns:
+            List: arguments, with any literal definitions (sets, tuples etc.) evaluated
+        """
         # TODO: The handling of the arguments is questionable, should mostly work for now, but be mindful there may
         # be issues here and a great spot to refactor
 
@@ -154,30 +279,80 @@ class Imposter:
                     requires_lit = True
 
         if requires_lit:
-            lits = [
+            return [
                 ast.literal_eval(arg) if isinstance(arg, str) else arg
                 for arg in self.arguments
             ]
-            return ImposterDirectResult(
-                getattr(fake, self.value.replace("fake.", ""))(*lits), "FAKER"
-            )
-        elif self.arguments:
-            return ImposterDirectResult(
-                getattr(fake, self.value.replace("fake.", ""))(*self.arguments), "FAKER"
-            )
-        else:
-            return ImposterDirectResult(
-                getattr(fake, self.value.replace("fake.", ""))(), "FAKER"
+        return list(self.arguments)
+
+    def _compile(self) -> Callable[[], ImposterResult]:
+        """Resolve the imposter once into a callable, so evaluating doesn't repeat the regex matching,
+        faker method lookup and argument parsing for every row
+
+        Returns:
+            Callable[[], ImposterResult]: callable returning a new result on each call
+        """
+        if self.imposter_type == ImposterType.STATIC:
+            self._constant = self._eval_static()
+        elif self.imposter_type == ImposterType.INCREMENT:
+            self._constant = self._eval_increment()
+        elif self.imposter_type == ImposterType.TABLE_RANDOM:
+            self._constant = self._eval_table_random()
+
+        if self._constant is not None:
+            constant = self._constant
+            return lambda: constant
+
+        # faker methods are looked up on the first evaluation, so loading a config never loads Faker
+        if self.pool_size:
+            return lambda: ImposterDirectResult(self._get_pool().get(), "FAKER")
+
+        def first_evaluation() -> ImposterDirectResult:
+            method = _faker_method(get_fake(), self.value)
+            arguments = self._parse_arguments()
+            self._generator = lambda: ImposterDirectResult(method(*arguments), "FAKER")
+            return self._generator()
+
+        return first_evaluation
+
+    def _get_pool(self) -> ValuePool:
+        """Value pool of the imposter, created on first use"""
+        if self.pool is None:
+            self.pool = ValuePool(
+                functools.partial(
+                    _generate_pool_batch, self._pool_seed, self.value, self._parse_arguments()
+                ),
+                self.pool_size,
+                self.pool_max_bytes,
             )
-
-    def evaluate(self):
-        if Imposter.is_static(self.value):
-            return self._eval_static()
-        if Imposter.is_increment(self.value):
-            return self._eval_increment()
-        if Imposter.is_table_random(self.value):
-            return self._eval_table_random()
-        return self._eval_faker()
+        return self.pool
+
+    def close(self) -> None:
+        """Stop refilling the value pool, if there is one"""
+        if self.pool is not None:
+            self.pool.close()
+
+    def evaluate(self) -> ImposterResult:
+        return self._generator()
+
+    def evaluate_batch(self, n: int) -> List[ImposterResult]:
+        """Evaluate the imposter n times in one call
+
+        Args:
+            n (int): number of results to generate
+
+        Returns:
+            List[ImposterResult]: list of n results
+        """
+        if self._constant is not None:
+            return [self._constant] * n
+        if self.pool_size:
+            return [
+                ImposterDirectResult(value, "FAKER")
+                for value in self._get_pool().get_batch(n)
+            ]
+        generator = self._generator
+        return [generator() for _ in range(n)]
 
     @classmethod
     def is_static(cls, value: str) -> bool:
@@ -209,14 +384,14 @@ class Imposter:
 
     @classmethod
     def is_type(cls, value: str):
-        faker_methods = [meth for meth in dir(fake) if meth[0] != "_"]
-        if value.replace("fake.", "").split("(")[0] in faker_methods:
+        # faker methods are only checked to be method names here, they're looked up once a value is needed
+        if cls.is_custom_method(value):
             return True
-        if not cls.is_custom_method(value):
-            raise InvalidValueError(
-                f"Imposter value must be valid faker method, got - {value}"
-            )
-        return True
+        if re.match(Imposter.FAKER_REGEX_CHECK, value):
+            return True
+        raise InvalidValueError(
+            f"Imposter value must be valid faker method, got - {value}"
+        )
 
     def __str__(self):
         return self.value
@@ -0,0 +1,114 @@
+from typing import Any, Dict, List, Tuple
+from datetime import datetime, timezone
+import json
+
+from .db_connector import BulkInsertStatement, DBConnector
+from .sequence import SequenceAllocator
+
+
+class ChangeJournal:
+    """Append-only journal of every change, kept in the `_cdc_journal` table alongside the generated tables.
+    Each change gets a global log sequence number (lsn), and is written with the before and after images of the row
+    as part of the transaction that made it, so consumers can read `WHERE lsn > ?` for everything since they last looked.
+    Before images come from an in memory copy of the latest image of each row, keyed by the table's primary key,
+    tables without a primary key have no before images.
+    """
+
+    TABLE_NAME = "_cdc_journal"
+
+    def __init__(self, db: DBConnector, sequences: SequenceAllocator):
+        """Init the journal
+
+        Args:
+            db (DBConnector): database the journal is kept in
+            sequences (SequenceAllocator): allocator the lsn sequence is registered with
+        """
+        self.db = db
+        self.sequences = sequences
+        self.key_fields: Dict[str, str] = {}
+        self.images: Dict[str, Dict[Any, Dict]] = {}  # table -> row key -> latest row image
+        self._pending: List[Tuple[str, str, Dict, Dict]] = []
+
+    def generate_create_table_str(self) -> str:
+        return f"""
+        CREATE TABLE if not exists {ChangeJournal.TABLE_NAME}(
+            lsn bigint primary key, table_name string, op string, before json, after json, commit_time timestamptz);
+        """
+
+    def prepare(self) -> None:
+        """Create the journal table if missing and register the lsn sequence, continuing from the last lsn"""
+        self.db.execute_sql(self.generate_create_table_str())
+        self.sequences.register(
+            ChangeJournal.TABLE_NAME,
+            "lsn",
+            (self.db.get_max_values(ChangeJournal.TABLE_NAME, ["lsn"])["lsn"] or 0) + 1,
+        )
+
+    def track(self, table_name: str, key_field: str, fields: List[str]) -> None:
+        """Load the latest images of a table's live rows, so its changes are journaled with before images
+
+        Args:
+            table_name (str): table name
+            key_field (str): primary key of the table
+            fields (List[str]): all fields of the table
+        """
+        self.key_fields[table_name] = key_field
+        self.images[table_name] = {
+            row[key_field]: row for row in self.db.get_live_rows(table_name, fields)
+        }
+
+    def record(self, table_name: str, rows: List[Dict]) -> None:
+        """Record changed rows, held until the journal is next flushed
+
+        Args:
+            table_name (str): table the rows belong to
+            rows (List[Dict]): changed rows
+        """
+        key_field = self.key_fields.get(table_name)
+        images = self.images.get(table_name)
+        for row in rows:
+            before = None
+            if key_field is not None:
+                if row.get("change_type") == "D":
+                    before = images.pop(row[key_field], None)
+                else:
+                    before = images.get(row[key_field])
+                    images[row[key_field]] = row
+            self._pending.append((table_name, row.get("change_type"), before, row))
+
+    def flush(self) -> None:
+        """Append the recorded changes to the journal, with the current time as their commit time"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, []
+        commit_time = datetime.now(timezone.utc)
+        self.db.execute_columnar(
+            BulkInsertStatement(
+                ChangeJournal.TABLE_NAME,
+                {
+                    "lsn": list(
+                        self.sequences.reserve(ChangeJournal.TABLE_NAME, "lsn", len(pending))
+                    ),
+                    "table_name": [table_name for table_name, _, _, _ in pending],
+                    "op": [op for _, op, _, _ in pending],
+                    "before": [_to_json(before) for _, _, before, _ in pending],
+                    "after": [_to_json(after) for _, _, _, after in pending],
+                    "commit_time": [commit_time] * len(pending),
+                },
+                returning=False,
+            )
+        )
+
+    def discard(self) -> None:
+        """Drop the recorded changes of a rolled back transaction"""
+        self._pending = []
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(tables={list(self.key_fields)}, pending={len(self._pending)})"
+
+
+def _to_json(row: Dict) -> str:
+    """Serialise a row image"""
+    if row is None:
+        return None
+    return json.dumps(row, default=str)
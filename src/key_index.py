@@ -0,0 +1,127 @@
+from typing import Any, Dict, List, Tuple
+import random
+import threading
+
+
+class KeySample:
+    """Values of a field across the live rows of a table, supporting O(1) updates and random sampling.
+    Each row holds a single slot, removal swaps the last slot into the freed position.
+    """
+
+    def __init__(self):
+        self.values = []  # field value per slot
+        self.row_keys = []  # row key per slot
+        self.slots = {}  # row key -> slot
+
+    def set(self, row_key: Any, value: Any) -> None:
+        slot = self.slots.get(row_key)
+        if slot is None:
+            self.slots[row_key] = len(self.values)
+            self.values.append(value)
+            self.row_keys.append(row_key)
+        else:
+            self.values[slot] = value
+
+    def remove(self, row_key: Any) -> None:
+        slot = self.slots.pop(row_key, None)
+        if slot is None:
+            return
+        last_value = self.values.pop()
+        last_row_key = self.row_keys.pop()
+        if slot < len(self.values):
+            self.values[slot] = last_value
+            self.row_keys[slot] = last_row_key
+            self.slots[last_row_key] = slot
+
+    def sample(self, default: Any) -> Any:
+        if not self.values:
+            return default
+        return random.choice(self.values)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class KeyIndex:
+    """In process index of the live values of fields used by table_random lookups.
+    Rows are identified by the table's primary key, so only tables with one can be indexed.
+    Changes are applied and sampled under a lock, as they're applied on a different thread to the one generating changes.
+    """
+
+    def __init__(self):
+        self.samples: Dict[Tuple[str, str], KeySample] = {}
+        self.row_key_fields: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def register(self, table_name: str, field_name: str, row_key_field: str):
+        """Register a table field to be indexed
+
+        Args:
+            table_name (str): table name
+            field_name (str): field to index the values of
+            row_key_field (str): primary key of the table, identifying a row
+        """
+        self.samples.setdefault((table_name, field_name), KeySample())
+        self.row_key_fields[table_name] = row_key_field
+
+    def get_fields(self, table_name: str) -> List[str]:
+        """Fields indexed for a table, including the field identifying the row
+
+        Args:
+            table_name (str): table name
+
+        Returns:
+            List[str]: field names, empty if the table isn't indexed
+        """
+        if table_name not in self.row_key_fields:
+            return []
+        fields = [self.row_key_fields[table_name]]
+        for table, field in self.samples:
+            if table == table_name and field not in fields:
+                fields.append(field)
+        return fields
+
+    def apply(self, table_name: str, rows: List[Dict]) -> None:
+        """Apply changed rows to the index, rows with a change type of 'D' are removed
+
+        Args:
+            table_name (str): table the rows belong to
+            rows (List[Dict]): changed rows
+        """
+        row_key_field = self.row_key_fields.get(table_name)
+        if row_key_field is None:
+            return
+        samples = [
+            (field, sample)
+            for (table, field), sample in self.samples.items()
+            if table == table_name
+        ]
+        with self._lock:
+            for row in rows:
+                row_key = row[row_key_field]
+                if row.get("change_type") == "D":
+                    for _, sample in samples:
+                        sample.remove(row_key)
+                else:
+                    for field, sample in samples:
+                        sample.set(row_key, row[field])
+
+    def sample(self, table_name: str, field_name: str, default: Any) -> Any:
+        """Randomly select a live value of a field
+
+        Args:
+            table_name (str): table name
+            field_name (str): field name
+            default (Any): value returned if the table has no live rows
+
+        Returns:
+            Any: selected value
+        """
+        with self._lock:
+            return self.samples[(table_name, field_name)].sample(default)
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self.samples
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({ {key: len(sample) for key, sample in self.samples.items()} })"
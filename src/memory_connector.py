@@ -0,0 +1,457 @@
+from typing import Any, Dict, List, Set, Tuple, Union
+from pathlib import Path
+import logging
+import operator
+import time
+
+import duckdb
+
+from .db_connector import (
+    BatchUpdateStatement,
+    BulkInsertStatement,
+    DBConnector,
+    InsertStatement,
+    SQLStatement,
+    Statement,
+    UpdateStatement,
+)
+
+
+logger = logging.getLogger()
+
+
+class TableState:
+    """Columnar in memory copy of a table.
+    Each row holds a slot across the column lists, slots never move so they can be used to undo changes,
+    hard deleted rows only free their slot once the table is compacted.
+    The keys of the rows inserted, updated or removed are kept until the next snapshot, so only those are written.
+    """
+
+    CONDITIONS = {
+        "==": operator.eq,
+        "!=": operator.ne,
+        ">=": operator.ge,
+        "<=": operator.le,
+        ">": operator.gt,
+        "<": operator.lt,
+    }
+
+    def __init__(self, table_name: str, columns: List[str], key_field: str = None):
+        """Init an empty table
+
+        Args:
+            table_name (str): table name
+            columns (List[str]): column names, in table order
+            key_field (str, optional): primary key, indexed for lookups and kept unique. Defaults to None.
+        """
+        self.table_name = table_name
+        self.columns = columns
+        self.key_field = key_field
+        self.data: Dict[str, List] = {column: [] for column in columns}
+        self.alive: List[bool] = []
+        self.index: Dict[Any, int] = {}  # key -> slot
+        self.dead = 0
+        self.changed: Set = set()  # keys changed since the last snapshot
+
+    def __len__(self) -> int:
+        return len(self.alive) - self.dead
+
+    def row(self, slot: int) -> Dict:
+        return {column: self.data[column][slot] for column in self.columns}
+
+    def slots(self) -> List[int]:
+        return [slot for slot, alive in enumerate(self.alive) if alive]
+
+    def insert(self, values: Dict[str, Any]) -> int:
+        """Insert a row
+
+        Args:
+            values (Dict[str, Any]): value per column, missing columns are null
+
+        Raises:
+            duckdb.ConstraintException: if the key already exists
+
+        Returns:
+            int: slot of the row
+        """
+        if self.key_field is not None:
+            key = values.get(self.key_field)
+            if key in self.index:
+                raise duckdb.ConstraintException(
+                    f"Duplicate key \"{self.key_field}: {key}\" violates primary key constraint of {self.table_name}"
+                )
+        slot = len(self.alive)
+        for column in self.columns:
+            self.data[column].append(values.get(column))
+        self.alive.append(True)
+        if self.key_field is not None:
+            self.index[values.get(self.key_field)] = slot
+            self.changed.add(values.get(self.key_field))
+        return slot
+
+    def update(self, slot: int, assignments: Dict[str, Any]) -> Dict[str, Any]:
+        """Update the columns of a row
+
+        Args:
+            slot (int): slot of the row
+            assignments (Dict[str, Any]): new value per column
+
+        Returns:
+            Dict[str, Any]: previous value per assigned column
+        """
+        previous = {}
+        for column, value in assignments.items():
+            previous[column] = self.data[column][slot]
+            self.data[column][slot] = value
+        if self.key_field is not None:
+            self.changed.add(self.data[self.key_field][slot])
+            if self.key_field in previous:
+                self.changed.add(previous[self.key_field])
+        return previous
+
+    def remove(self, slot: int) -> None:
+        self.alive[slot] = False
+        self.dead += 1
+        if self.key_field is not None:
+            self.index.pop(self.data[self.key_field][slot], None)
+            self.changed.add(self.data[self.key_field][slot])
+
+    def restore(self, slot: int) -> None:
+        self.alive[slot] = True
+        self.dead -= 1
+        if self.key_field is not None:
+            self.index[self.data[self.key_field][slot]] = slot
+            self.changed.add(self.data[self.key_field][slot])
+
+    def find(self, field: str, condition: str, value: Any) -> List[int]:
+        """Slots of the live (not soft deleted) rows matching a where condition, null never matches
+
+        Args:
+            field (str): field compared, None to match every live row
+            condition (str): comparison, one of CONDITIONS
+            value (Any): value compared against
+
+        Returns:
+            List[int]: matching slots
+        """
+        change_types = self.data["change_type"]
+        if field is None:
+            return [slot for slot in self.slots() if change_types[slot] != "D"]
+        if field == self.key_field and condition == "==":
+            slot = self.index.get(value)
+            if slot is None or change_types[slot] == "D":
+                return []
+            return [slot]
+
+        compare = TableState.CONDITIONS[condition]
+        values = self.data[field]
+        matches = []
+        for slot in self.slots():
+            if change_types[slot] == "D" or values[slot] is None or value is None:
+                continue
+            try:
+                if compare(values[slot], value):
+                    matches.append(slot)
+            except TypeError:
+                continue
+        return matches
+
+    def compact(self) -> None:
+        """Free the slots of hard deleted rows"""
+        if not self.dead:
+            return
+        live = self.slots()
+        self.data = {
+            column: [values[slot] for slot in live] for column, values in self.data.items()
+        }
+        self.alive = [True] * len(live)
+        self.dead = 0
+        if self.key_field is not None:
+            self.index = {key: slot for slot, key in enumerate(self.data[self.key_field])}
+
+    def to_frame(self, slots: List[int] = None) -> "pd.DataFrame":
+        """Rows as a data frame
+
+        Args:
+            slots (List[int], optional): slots of the rows, None for every live row. Defaults to None.
+
+        Returns:
+            pd.DataFrame: one column per table column
+        """
+        import pandas as pd  # only needed for snapshots, importing it is most of the cost of starting up
+
+        live = slots if slots is not None else self.slots() if self.dead else range(len(self.alive))
+        return pd.DataFrame(
+            {
+                column: pd.Series([self.data[column][slot] for slot in live], dtype=object)
+                for column in self.columns
+            }
+        )
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(table_name={self.table_name}, rows={len(self)}, dead={self.dead})"
+
+
+class MemoryConnector(DBConnector):
+    """Backend keeping the state of the generated tables in memory rather than in DuckDB.
+    Statements are applied to columnar copies of the tables, loaded from the database when first used,
+    and the tables are written back to the database as a snapshot every `snapshot_every_ms` and on shutdown.
+    Other tables (the change journal) and any raw SQL go straight to the database,
+    SQLStatement values are resolved against the last snapshot.
+    """
+
+    DEFAULT_SNAPSHOT_EVERY_MS = 10000
+
+    def __init__(
+        self,
+        db_path: Path,
+        table_names: List[str],
+        snapshot_every_ms: int = DEFAULT_SNAPSHOT_EVERY_MS,
+    ):
+        """Init the connector
+
+        Args:
+            db_path (Path): database snapshots are written to
+            table_names (List[str]): tables held in memory
+            snapshot_every_ms (int, optional): time between snapshots in milliseconds. Defaults to DEFAULT_SNAPSHOT_EVERY_MS.
+        """
+        super().__init__(db_path)
+        self.table_names = set(table_names)
+        self.snapshot_every_ms = snapshot_every_ms
+        self.tables: Dict[str, TableState] = {}
+        self.dirty = set()  # tables changed since the last snapshot
+        self.archived: Dict[str, List[Dict]] = {}  # archive table -> rows awaiting the next snapshot
+        self._undo: List[Tuple] = None  # changes to revert on rollback, None outside a transaction
+        self._last_snapshot = time.monotonic()
+
+    def _state(self, table_name: str) -> TableState:
+        """In memory copy of a table, loaded from the database when first used
+
+        Args:
+            table_name (str): table name
+
+        Returns:
+            TableState: table state, None if the table isn't held in memory
+        """
+        if table_name not in self.table_names:
+            return None
+        state = self.tables.get(table_name)
+        if state is None:
+            columns = [row[0] for row in self.conn.sql(f"DESCRIBE {table_name}").fetchall()]
+            key = self.conn.execute(
+                "SELECT constraint_column_names[1] FROM duckdb_constraints() WHERE table_name = ? AND constraint_type = 'PRIMARY KEY'",
+                (table_name,),
+            ).fetchone()
+            state = TableState(table_name, columns, key[0] if key else None)
+            for row in self.conn.sql(f"SELECT * FROM {table_name}").fetchall():
+                state.insert(dict(zip(columns, row)))
+            state.changed = set()
+            self.tables[table_name] = state
+        return state
+
+    def _resolve_value(self, value: Any) -> Any:
+        return self.resolve(value) if isinstance(value, SQLStatement) else value
+
+    def _inserted(self, state: TableState, slot: int) -> Dict:
+        self.dirty.add(state.table_name)
+        if self._undo is not None:
+            self._undo.append(("insert", state, slot))
+        return state.row(slot)
+
+    def _updated(self, state: TableState, slot: int, assignments: Dict[str, Any]) -> Dict:
+        previous = state.update(slot, assignments)
+        self.dirty.add(state.table_name)
+        if self._undo is not None:
+            self._undo.append(("update", state, slot, previous))
+        return state.row(slot)
+
+    def begin(self) -> None:
+        self._undo = []
+
+    def commit(self) -> None:
+        self._undo = None
+
+    def rollback(self) -> None:
+        for change in reversed(self._undo or []):
+            kind, state, slot = change[:3]
+            if kind == "insert":
+                state.remove(slot)
+            elif kind == "update":
+                state.update(slot, change[3])
+            else:
+                state.restore(slot)
+        self._undo = None
+
+    def get_live_rows(self, table_name: str, fields: List[str]) -> List[Dict]:
+        state = self._state(table_name)
+        if state is None:
+            return super().get_live_rows(table_name, fields)
+        return [
+            {field: state.data[field][slot] for field in fields}
+            for slot in state.find(None, None, None)
+        ]
+
+    def get_max_values(self, table_name: str, fields: List[str]) -> Dict[str, int]:
+        state = self._state(table_name)
+        if state is None:
+            # archived rows awaiting the next snapshot aren't in the database yet
+            max_values = super().get_max_values(table_name, fields)
+            for row in self.archived.get(table_name, []):
+                for field in fields:
+                    value = row.get(field)
+                    if value is not None and (
+                        max_values[field] is None or value > max_values[field]
+                    ):
+                        max_values[field] = value
+            return max_values
+        slots = state.slots()
+        return {
+            field: max(
+                (state.data[field][slot] for slot in slots if state.data[field][slot] is not None),
+                default=None,
+            )
+            for field in fields
+        }
+
+    def delete_tombstones(
+        self, table_name: str, key_field: str, keys: List, archive_table: str = None
+    ) -> int:
+        state = self._state(table_name)
+        if state is None:
+            return super().delete_tombstones(table_name, key_field, keys, archive_table)
+        keys = set(keys)
+        change_types = state.data["change_type"]
+        if key_field == state.key_field:
+            slots = [state.index[key] for key in keys if key in state.index]
+        else:
+            slots = [slot for slot in state.slots() if state.data[key_field][slot] in keys]
+        slots = [slot for slot in slots if change_types[slot] == "D"]
+        for slot in slots:
+            if archive_table is not None:
+                self.archived.setdefault(archive_table, []).append(state.row(slot))
+            state.remove(slot)
+            if self._undo is not None:
+                self._undo.append(("remove", state, slot))
+        if slots:
+            self.dirty.add(table_name)
+        return len(slots)
+
+    def execute_prepared(self, statement: Union[InsertStatement, UpdateStatement]) -> List[Dict]:
+        state = self._state(statement.table_name)
+        if state is None:
+            return super().execute_prepared(statement)
+        rows = []
+        if isinstance(statement, InsertStatement):
+            for params in statement.params:
+                values = dict(zip(statement.columns, map(self._resolve_value, params)))
+                rows.append(self._inserted(state, state.insert(values)))
+        elif isinstance(statement, UpdateStatement):
+            assignments = {
+                field: self._resolve_value(value)
+                for field, value in statement.assignments.items()
+            }
+            for slot in state.find(
+                statement.where_field,
+                statement.where_condition,
+                self._resolve_value(statement.where_value),
+            ):
+                rows.append(self._updated(state, slot, assignments))
+        else:
+            return super().execute_prepared(statement)
+        return rows
+
+    def execute_columnar(
+        self, statement: Union[BulkInsertStatement, BatchUpdateStatement]
+    ) -> List[Dict]:
+        state = self._state(statement.table_name)
+        if state is None:
+            return super().execute_columnar(statement)
+        columns = {
+            name: [self._resolve_value(value) for value in values]
+            for name, values in statement.columns.items()
+        }
+        rows = []
+        if isinstance(statement, BulkInsertStatement):
+            for i in range(len(statement)):
+                values = {name: values[i] for name, values in columns.items()}
+                rows.append(self._inserted(state, state.insert(values)))
+        else:
+            keys = columns.pop("_key")
+            for i, key in enumerate(keys):
+                for slot in state.find(statement.key_field, "==", key):
+                    rows.append(
+                        self._updated(
+                            state, slot, {name: values[i] for name, values in columns.items()}
+                        )
+                    )
+        return rows
+
+    def execute(self, statements: List[Statement]) -> List[Dict]:
+        changed_rows = []
+        for statement in statements:
+            if isinstance(statement, (InsertStatement, UpdateStatement)):
+                changed_rows.extend(self.execute_prepared(statement))
+            elif isinstance(statement, (BulkInsertStatement, BatchUpdateStatement)):
+                changed_rows.extend(self.execute_columnar(statement))
+            else:
+                changed_rows.extend(super().execute([statement]))
+        changed_rows.sort(key=lambda row: row["change_token"])
+        return changed_rows
+
+    def snapshot_due(self) -> bool:
+        return (
+            self._undo is None
+            and (time.monotonic() - self._last_snapshot) * 1000 >= self.snapshot_every_ms
+        )
+
+    def snapshot(self) -> None:
+        """Write the rows changed since the last snapshot back to the database, replacing them by key,
+        and append any archived rows, all in one transaction. Tables without a primary key are replaced in full
+        """
+        self._last_snapshot = time.monotonic()
+        if not self.dirty and not self.archived:
+            return
+        logging.info(f"Writing snapshot of {', '.join(sorted(self.dirty))}")
+        import pandas as pd
+
+        self.conn.begin()
+        try:
+            for table_name in self.dirty:
+                state = self.tables[table_name]
+                state.compact()
+                if state.key_field is None:
+                    self.conn.execute(f"DELETE FROM {table_name}")
+                    self._append(table_name, state.columns, state.to_frame())
+                    continue
+                keys = list(state.changed)
+                self.conn.execute(
+                    f"DELETE FROM {table_name} WHERE {state.key_field} IN (SELECT UNNEST(?))",
+                    (keys,),
+                )
+                slots = [state.index[key] for key in keys if key in state.index]
+                if slots:
+                    self._append(table_name, state.columns, state.to_frame(slots))
+            for archive_table, rows in self.archived.items():
+                columns = list(rows[0])
+                self._append(archive_table, columns, pd.DataFrame(rows, columns=columns, dtype=object))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        for table_name in self.dirty:
+            self.tables[table_name].changed = set()
+        self.dirty = set()
+        self.archived = {}
+
+    def _append(self, table_name: str, columns: List[str], frame: "pd.DataFrame") -> None:
+        relation_name = f"_snapshot_{table_name}"
+        self.conn.register(relation_name, frame)
+        try:
+            self.conn.execute(
+                f"INSERT INTO {table_name} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM {relation_name}"
+            )
+        finally:
+            self.conn.unregister(relation_name)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({list(self.tables.values())})"
@@ -0,0 +1,103 @@
+from typing import Any, Callable
+import logging
+import queue
+import threading
+
+
+logger = logging.getLogger()
+
+
+class Stage:
+    """Pipeline stage handling items in a thread of its own, fed through a bounded queue.
+    Putting to a full stage blocks, so a slow stage holds back the stages feeding it.
+    A failed stage keeps taking items and discarding them, so upstream stages never block on it,
+    the error is kept to be raised by the thread driving the pipeline.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], None],
+        queue_size: int,
+        on_stop: Callable[[bool], None] = None,
+        on_idle: Callable[[], None] = None,
+        idle_s: float = 1.0,
+    ):
+        """Init the stage
+
+        Args:
+            name (str): stage name, used for the thread name and in log messages
+            handler (Callable[[Any], None]): called with each item put to the stage
+            queue_size (int): max number of items waiting on the stage
+            on_stop (Callable[[bool], None], optional): called once the queue is drained on stopping,
+                with whether the stage completed cleanly. Defaults to None.
+            on_idle (Callable[[], None], optional): called when no items have arrived for `idle_s`. Defaults to None.
+            idle_s (float, optional): seconds without items before on_idle is called. Defaults to 1.0.
+        """
+        self.name = name
+        self.handler = handler
+        self.on_stop = on_stop
+        self.on_idle = on_idle
+        self.idle_s = idle_s
+        self.error = None
+
+        self._queue = queue.Queue(queue_size)
+        self._completed = True
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_s if self.on_idle else None)
+            except queue.Empty:
+                item = None
+            if item is Stage._STOP:
+                break
+            if self.error is not None:
+                continue
+            try:
+                if item is None:
+                    self.on_idle()
+                else:
+                    self.handler(item)
+            except Exception as e:
+                logger.exception(f"Pipeline stage {self.name} failed")
+                self.error = e
+
+        if self.on_stop is not None:
+            try:
+                self.on_stop(self._completed and self.error is None)
+            except Exception as e:
+                logger.exception(f"Pipeline stage {self.name} failed to stop")
+                self.error = self.error or e
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def put(self, item: Any) -> None:
+        """Queue an item for the stage, blocking while the queue is full
+
+        Args:
+            item (Any): item to handle
+        """
+        self._queue.put(item)
+
+    def stop(self, completed: bool = True) -> None:
+        """Stop the stage once the items already queued have been handled, and wait for it to finish
+
+        Args:
+            completed (bool, optional): whether the stages upstream completed cleanly. Defaults to True.
+        """
+        self._completed = completed
+        self._queue.put(Stage._STOP)
+        self._thread.join()
+
+    def raise_error(self) -> None:
+        """Raise the error the stage failed with, if any"""
+        if self.error is not None:
+            raise self.error
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(name={self.name}, queued={self._queue.qsize()})"
@@ -0,0 +1,150 @@
+from typing import Any, Callable, List
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+
+
+_executor = None  # process the values of every pool are generated in, started by the first pool
+
+
+def _init_process() -> None:
+    """Tie the generating process to the one it generates for, stopping when it does
+    rather than on an interrupt, or being left behind if it crashes
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    parent = multiprocessing.parent_process()
+    threading.Thread(target=lambda: (parent.join(), os._exit(0)), daemon=True).start()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """Process pool values are generated in, shared by all pools and started on first use.
+    A single process handles the batches of every pool in the order they're requested, off the GIL of the generator
+
+    Returns:
+        ProcessPoolExecutor: executor with one spawned process
+    """
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process,
+        )
+    return _executor
+
+
+def shutdown() -> None:
+    """Stop the process values are generated in, if it was started. Processes don't exit while it's running"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+class ValuePool:
+    """Pool of pre-generated values for an imposter.
+    Values are generated in batches in another process, a new batch is requested once the pool drops below half full
+    and added when it's ready, so draws only wait on the other process when the pool runs dry.
+    Each value is drawn once, oldest first. A pool holds at most `size` values, fewer if they would take more than
+    `max_bytes`, sized from the values generated so far. Batches of a pool are generated one after another
+    from the same source, so a seeded generator gives the same values on every run whatever the batch sizes.
+    """
+
+    DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+    def __init__(
+        self,
+        generate_batch: Callable[[int], List[Any]],
+        size: int,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        """Init the pool and request its first batch
+
+        Args:
+            generate_batch (Callable[[int], List[Any]]): picklable callable generating n values, called in the other process
+            size (int): max number of values to hold
+            max_bytes (int, optional): memory cap of the held values. Defaults to DEFAULT_MAX_BYTES.
+        """
+        self.generate_batch = generate_batch
+        self.size = size
+        self.max_bytes = max_bytes
+
+        self._values = deque()
+        self._capacity = size  # values held at most, lowered once their size is known
+        self._generated = 0
+        self._generated_bytes = 0
+        self._pending: Future = None  # batch being generated
+        self._request(size)
+
+    def _request(self, n: int) -> None:
+        self._pending = get_executor().submit(self.generate_batch, n)
+
+    def _collect(self) -> None:
+        """Add the batch being generated to the pool, waiting for it if it isn't ready
+
+        Raises:
+            Exception: error raised by the generator
+        """
+        pending, self._pending = self._pending, None
+        values = pending.result()
+        self._values.extend(values)
+        self._generated += len(values)
+        self._generated_bytes += sum(map(sys.getsizeof, values))
+        if self._generated_bytes:
+            self._capacity = max(
+                1,
+                min(self.size, self.max_bytes * self._generated // self._generated_bytes),
+            )
+
+    def get(self) -> Any:
+        """Draw a single value, waiting for one if the pool has run dry
+
+        Returns:
+            Any: generated value
+        """
+        return self.get_batch(1)[0]
+
+    def get_batch(self, n: int) -> List[Any]:
+        """Draw n values, waiting for the other process to generate any not available in the pool
+
+        Args:
+            n (int): number of values
+
+        Returns:
+            List[Any]: generated values
+
+        Raises:
+            Exception: error raised by the generator
+        """
+        values = []
+        while len(values) < n:
+            if not self._values:
+                if self._pending is None:
+                    self._request(max(n - len(values), self._capacity))
+                self._collect()
+                continue
+            take = min(n - len(values), len(self._values))
+            values.extend(self._values.popleft() for _ in range(take))
+
+        if self._pending is not None and self._pending.done():
+            self._collect()
+        if self._pending is None and len(self._values) <= self._capacity // 2:
+            self._request(self._capacity - len(self._values))
+        return values
+
+    def close(self) -> None:
+        """Drop the held values and the batch being generated, if it hasn't started"""
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        self._values.clear()
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(size={self.size}, max_bytes={self.max_bytes}, held={len(self)})"
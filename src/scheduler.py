@@ -0,0 +1,335 @@
+from typing import Any, Callable, Dict, List
+import math
+import time
+
+from .exceptions import InvalidConfigSettingError, validate_keys
+
+
+class RateProfile:
+    """Parent class for rate profiles. A profile scales the base rate over time since the scheduler started"""
+
+    REQUIRED_CONFIG_KEYS = ["type"]
+    OPTIONAL_CONFIG_KEYS = []
+
+    def multiplier(self, elapsed: float) -> float:
+        """Multiplier applied to the base rate
+
+        Args:
+            elapsed (float): seconds since the scheduler started
+
+        Returns:
+            float: rate multiplier
+        """
+        return 1.0
+
+    @classmethod
+    def from_config(cls, config: Dict) -> "RateProfile":
+        """Create the profile matching the `type` of a profile config
+
+        Args:
+            config (Dict): profile config
+
+        Raises:
+            InvalidConfigSettingError: if the profile type isn't recognised
+
+        Returns:
+            RateProfile: profile object
+        """
+        profile_types = {
+            "constant": ConstantProfile,
+            "ramp": RampProfile,
+            "diurnal": DiurnalProfile,
+            "spike": SpikeProfile,
+        }
+        profile_type = profile_types.get(str(config.get("type", "")).lower())
+        if profile_type is None:
+            raise InvalidConfigSettingError(
+                f"Rate profile type must be one of {', '.join(profile_types)} - got `{config.get('type')}`"
+            )
+        validate_keys(
+            dictionary=config,
+            required_keys=profile_type.REQUIRED_CONFIG_KEYS,
+            optional_keys=profile_type.OPTIONAL_CONFIG_KEYS,
+            additional_context=f"Rate profile `{config['type']}`",
+        )
+        settings = {key: value for key, value in config.items() if key != "type"}
+        for key, value in settings.items():
+            if not isinstance(value, (int, float)) or value < 0:
+                raise InvalidConfigSettingError(
+                    f"Rate profile setting `{key}` must be a non-negative number"
+                )
+        return profile_type(**settings)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.__dict__})"
+
+
+class ConstantProfile(RateProfile):
+    """Runs at the base rate throughout"""
+
+
+class RampProfile(RateProfile):
+    """Ramps linearly from `start_multiplier` of the base rate up to the base rate over `duration_s`"""
+
+    REQUIRED_CONFIG_KEYS = RateProfile.REQUIRED_CONFIG_KEYS + ["duration_s"]
+    OPTIONAL_CONFIG_KEYS = RateProfile.OPTIONAL_CONFIG_KEYS + ["start_multiplier"]
+
+    def __init__(self, duration_s: float, start_multiplier: float = 0.0):
+        self.duration_s = duration_s
+        self.start_multiplier = start_multiplier
+
+    def multiplier(self, elapsed: float) -> float:
+        if self.duration_s == 0 or elapsed >= self.duration_s:
+            return 1.0
+        return self.start_multiplier + (1.0 - self.start_multiplier) * (
+            elapsed / self.duration_s
+        )
+
+
+class DiurnalProfile(RateProfile):
+    """Follows a cosine curve over `period_s`, peaking at `peak_s` into the period.
+    The multiplier swings between 1 - amplitude and 1 + amplitude
+    """
+
+    OPTIONAL_CONFIG_KEYS = RateProfile.OPTIONAL_CONFIG_KEYS + [
+        "period_s",
+        "amplitude",
+        "peak_s",
+    ]
+
+    def __init__(
+        self, period_s: float = 86400, amplitude: float = 0.5, peak_s: float = None
+    ):
+        self.period_s = period_s
+        self.amplitude = amplitude
+        self.peak_s = peak_s if peak_s is not None else period_s / 2
+
+    def multiplier(self, elapsed: float) -> float:
+        phase = 2 * math.pi * (elapsed - self.peak_s) / self.period_s
+        return max(0.0, 1.0 + self.amplitude * math.cos(phase))
+
+
+class SpikeProfile(RateProfile):
+    """Multiplies the rate by `multiplier` for `duration_s` out of every `every_s`"""
+
+    REQUIRED_CONFIG_KEYS = RateProfile.REQUIRED_CONFIG_KEYS + [
+        "every_s",
+        "duration_s",
+        "multiplier",
+    ]
+
+    def __init__(self, every_s: float, duration_s: float, multiplier: float):
+        if multiplier == 0 and every_s and duration_s >= every_s:
+            raise InvalidConfigSettingError(
+                "Rate profile `spike` with a multiplier of 0 must have a duration_s shorter than every_s"
+            )
+        self.every_s = every_s
+        self.duration_s = duration_s
+        self.spike_multiplier = multiplier
+
+    def multiplier(self, elapsed: float) -> float:
+        if self.every_s and elapsed % self.every_s < self.duration_s:
+            return self.spike_multiplier
+        return 1.0
+
+
+class RateLimit:
+    """Target rate of events, shaped by any number of profiles whose multipliers are combined"""
+
+    REQUIRED_CONFIG_KEYS = ["events_per_second"]
+    OPTIONAL_CONFIG_KEYS = ["burst", "profile"]
+
+    def __init__(
+        self,
+        events_per_second: float = None,
+        burst: int = 1,
+        profiles: List[RateProfile] = [],
+    ):
+        """Init the rate limit
+
+        Args:
+            events_per_second (float, optional): base rate, None for no limit. Defaults to None.
+            burst (int, optional): number of events that can be run back to back to catch up after falling behind. Defaults to 1.
+            profiles (List[RateProfile], optional): profiles shaping the rate over time. Defaults to [].
+        """
+        self.events_per_second = events_per_second
+        self.burst = burst
+        self.profiles = profiles
+
+    def rate(self, elapsed: float) -> float:
+        """Rate in events per second at a point in time
+
+        Args:
+            elapsed (float): seconds since the scheduler started
+
+        Returns:
+            float: events per second, None for no limit
+        """
+        if self.events_per_second is None:
+            return None
+        rate = self.events_per_second
+        for profile in self.profiles:
+            rate *= profile.multiplier(elapsed)
+        return rate
+
+    @classmethod
+    def from_interval(cls, interval: float) -> "RateLimit":
+        """Rate limit of a fixed delay between events"""
+        return cls(1 / interval if interval else None)
+
+    @classmethod
+    def from_config(cls, config: Dict, context: str = "") -> "RateLimit":
+        """Create a rate limit from a `rate` config
+
+        Args:
+            config (Dict): rate config
+            context (str, optional): where the config is from, for error messages. Defaults to "".
+
+        Raises:
+            InvalidConfigSettingError: if a setting is invalid
+
+        Returns:
+            RateLimit: rate limit object
+        """
+        validate_keys(
+            dictionary=config,
+            required_keys=RateLimit.REQUIRED_CONFIG_KEYS,
+            optional_keys=RateLimit.OPTIONAL_CONFIG_KEYS,
+            additional_context=f"Rate {context}",
+        )
+        events_per_second = config["events_per_second"]
+        if not isinstance(events_per_second, (int, float)) or events_per_second <= 0:
+            raise InvalidConfigSettingError(
+                f"events_per_second must be a positive number - {context}"
+            )
+        burst = config.get("burst", 1)
+        if not isinstance(burst, int) or burst < 1:
+            raise InvalidConfigSettingError(
+                f"burst must be a positive integer - {context}"
+            )
+        profiles = config.get("profile", [])
+        if isinstance(profiles, dict):
+            profiles = [profiles]
+        return cls(
+            events_per_second,
+            burst,
+            [RateProfile.from_config(profile) for profile in profiles],
+        )
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.__dict__})"
+
+
+class Stream:
+    """Stream of events paced by a rate limit, with the events handed out round robin across its items"""
+
+    # longest step taken through the rate profile when working out the next due time
+    MAX_STEP = 1.0
+    # longest the rate profile may stay at zero before it's taken as never producing another event
+    MAX_IDLE_S = 7 * 86400
+
+    def __init__(self, items: List[Any], limit: RateLimit):
+        self.items = items
+        self.limit = limit
+        self.due = 0.0  # time the next event is due, relative to the scheduler start
+        self._position = 0
+
+    def advance(self, now: float) -> Any:
+        """Take the next item and move the due time on to the following event.
+        Due times move on from the scheduled time rather than the actual time, so any lateness doesn't accumulate,
+        but never to more than `burst` events in the past.
+
+        Args:
+            now (float): current time relative to the scheduler start
+
+        Returns:
+            Any: next item
+        """
+        item = self.items[self._position]
+        self._position = (self._position + 1) % len(self.items)
+
+        if self.limit.events_per_second is None:
+            self.due = now
+            return item
+
+        # step through the profile until a whole event's worth of rate has accumulated,
+        # in steps of at most MAX_STEP so a low rate doesn't skip past a rise in the profile
+        due = self.due
+        accumulated = 0.0
+        while accumulated < 1.0:
+            rate = self.limit.rate(due)
+            step = Stream.MAX_STEP
+            if rate > 0:
+                step = min(step, (1.0 - accumulated) / rate)
+                accumulated += rate * step
+            elif due - self.due >= Stream.MAX_IDLE_S:
+                raise InvalidConfigSettingError(
+                    f"Rate profiles stay at a rate of 0 for over {Stream.MAX_IDLE_S}s - {self.limit}"
+                )
+            due += step
+        interval = due - self.due
+        self.due = max(due, now - (self.limit.burst - 1) * interval)
+        return item
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(items={self.items}, limit={self.limit}, due={self.due})"
+
+
+class VirtualClock:
+    """Simulated time source for the scheduler, sleeping moves time on instantly rather than waiting"""
+
+    def __init__(self, start: float = 0.0):
+        self.time = start
+
+    def now(self) -> float:
+        return self.time
+
+    def sleep(self, seconds: float) -> None:
+        self.time += seconds
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(time={self.time})"
+
+
+class Scheduler:
+    """Paces events across a set of streams, each event goes to the stream next due"""
+
+    def __init__(
+        self,
+        streams: List[Stream],
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """Init the scheduler
+
+        Args:
+            streams (List[Stream]): streams to pace
+            clock (Callable[[], float], optional): time source in seconds. Defaults to time.monotonic.
+            sleep (Callable[[float], None], optional): waits for a number of seconds. Defaults to time.sleep.
+        """
+        self.streams = [stream for stream in streams if stream.items]
+        self.clock = clock
+        self.sleep = sleep
+        self.start = None
+
+    def elapsed(self) -> float:
+        if self.start is None:
+            return 0.0
+        return self.clock() - self.start
+
+    def next(self) -> Any:
+        """Wait until the next event is due
+
+        Returns:
+            Any: item the event is for
+        """
+        if self.start is None:
+            self.start = self.clock()
+        stream = min(self.streams, key=lambda stream: stream.due)
+        wait = stream.due - self.elapsed()
+        if wait > 0:
+            self.sleep(wait)
+        return stream.advance(self.elapsed())
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.streams})"
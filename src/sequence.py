@@ -0,0 +1,108 @@
+from typing import Any, Dict, Tuple
+
+
+class Sequence:
+    """Hands out increasing ids for a single field.
+    Ids are taken from blocks of `block_size` reserved from the sequence's high water mark,
+    ids left over in a block when a larger range is requested are skipped.
+    """
+
+    def __init__(self, start: int, block_size: int = 1):
+        self.block_size = block_size
+        self._high = start  # first id not yet reserved
+        self._next = start
+        self._block_end = start
+
+    def _reserve_block(self, size: int) -> int:
+        """Reserve a block of ids
+
+        Args:
+            size (int): number of ids in the block
+
+        Returns:
+            int: first id of the block
+        """
+        start = self._high
+        self._high += size
+        return start
+
+    def reserve(self, n: int) -> range:
+        """Reserve n consecutive ids
+
+        Args:
+            n (int): number of ids
+
+        Returns:
+            range: reserved ids
+        """
+        if self._block_end - self._next < n:
+            size = max(n, self.block_size)
+            self._next = self._reserve_block(size)
+            self._block_end = self._next + size
+        ids = range(self._next, self._next + n)
+        self._next += n
+        return ids
+
+    def next(self) -> int:
+        return self.reserve(1)[0]
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(next={self._next}, block_end={self._block_end})"
+
+
+class SharedSequence(Sequence):
+    """Sequence reserving its blocks from a counter shared between processes, so ids are unique across them.
+    The counter is a `multiprocessing.Value`, each process seeds it with its own start and the highest wins
+    """
+
+    def __init__(self, counter: Any, start: int, block_size: int = 1):
+        self.counter = counter
+        with counter.get_lock():
+            counter.value = max(counter.value, start)
+        super().__init__(start, block_size)
+
+    def _reserve_block(self, size: int) -> int:
+        with self.counter.get_lock():
+            start = self.counter.value
+            self.counter.value += size
+        return start
+
+
+class SequenceAllocator:
+    """In memory sequences for the increment fields of each table, seeded once from the database.
+    Fields with a shared counter use a SharedSequence, change tokens are then reserved one at a time
+    so they stay in order across processes
+    """
+
+    def __init__(self, block_size: int = 1, counters: Dict[Tuple[str, str], Any] = None):
+        self.block_size = block_size
+        self.counters = counters or {}
+        self.sequences: Dict[Tuple[str, str], Sequence] = {}
+
+    def register(self, table_name: str, field_name: str, start: int) -> None:
+        """Register the sequence for a table field
+
+        Args:
+            table_name (str): table name
+            field_name (str): increment field
+            start (int): first id to hand out
+        """
+        counter = self.counters.get((table_name, field_name))
+        if counter is None:
+            self.sequences[(table_name, field_name)] = Sequence(start, self.block_size)
+        else:
+            self.sequences[(table_name, field_name)] = SharedSequence(
+                counter, start, 1 if field_name == "change_token" else self.block_size
+            )
+
+    def next(self, table_name: str, field_name: str) -> int:
+        return self.sequences[(table_name, field_name)].next()
+
+    def reserve(self, table_name: str, field_name: str, n: int) -> range:
+        return self.sequences[(table_name, field_name)].reserve(n)
+
+    def __contains__(self, key: Tuple[str, str]) -> bool:
+        return key in self.sequences
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.sequences})"
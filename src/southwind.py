@@ -1,23 +1,141 @@
+from typing import Dict, List, Tuple
+from datetime import datetime, timezone
 import time
 
+from . import pool
+from .checkpoint import ExportCheckpoint
 from .config import Config
-from .db_connector import DBConnector
-from .exporter import Exporter
+from .db_connector import DBConnector, Statement
+from .exceptions import InvalidConfigSettingError
+from .exporter import RollingFile
+from .imposter import ImposterType
+from .journal import ChangeJournal
+from .key_index import KeyIndex
+from .memory_connector import MemoryConnector
+from .pipeline import Stage
+from .sequence import SequenceAllocator
+from .tombstones import TombstoneSweeper
+from .transaction import TransactionBatcher
+from .scheduler import RateLimit, Scheduler, Stream, VirtualClock
 
 
 class SouthWind:
-    def __init__(self, config_path: str):
+    # actions per transaction in a backfill, unless the config sets how often to commit
+    BACKFILL_COMMIT_EVERY = 1000
+
+    def __init__(
+        self,
+        config_path: str,
+        db_path: str = None,
+        sequences: SequenceAllocator = None,
+    ):
+        """Init the generator from a config file
+
+        Args:
+            config_path (str): path to config file
+            db_path (str, optional): database to use in place of the configured `db_path`. Defaults to None.
+            sequences (SequenceAllocator, optional): allocator for increment values in place of a local one. Defaults to None.
+        """
 
         self.cnf = Config(config_path)
-        self.db = DBConnector(self.cnf.db_path)
-        self.exporter = Exporter(self.cnf.output_path)
-        self.tables = self.cnf.load_datasets()
+        self.key_index = KeyIndex()
+        self.sequences = sequences or SequenceAllocator(self.cnf.increment_block_size)
+        self.tables = self.cnf.load_datasets(self.key_index, self.sequences)
+        self.checkpoint = (
+            ExportCheckpoint(self.cnf.output_path) if self.cnf.checkpoint else None
+        )
+        self.exporter = self.cnf.load_exporter(self.tables, self.file_completed)
+        if self.cnf.backend == "MEMORY":
+            self.db = MemoryConnector(
+                db_path or self.cnf.db_path,
+                [table.table_name for table in self.tables],
+                self.cnf.snapshot_every_ms,
+            )
+        else:
+            self.db = DBConnector(db_path or self.cnf.db_path)
+        # actions are generated on the calling thread, then applied and exported by stages of their own
+        self.apply_stage = Stage(
+            "apply",
+            self.apply_action,
+            self.cnf.pipeline_queue_size,
+            self.end_apply,
+            on_idle=self.commit_expired,
+            idle_s=min(1.0, self.cnf.commit_every_ms / 1000)
+            if self.cnf.commit_every_ms
+            else 1.0,
+        )
+        self.export_stage = Stage(
+            "export",
+            self.export_committed,
+            self.cnf.pipeline_queue_size,
+            on_idle=self.exporter.rotate_expired,
+        )
+        self.journal = (
+            ChangeJournal(self.db, self.sequences) if self.cnf.journal else None
+        )
+        self.transactions = TransactionBatcher(
+            self.db,
+            lambda table_name, rows: self.export_stage.put((table_name, rows)),
+            self.cnf.commit_every_n_actions,
+            self.cnf.commit_every_ms,
+            self.journal.flush if self.journal else None,
+        )
+        self.event_start = None  # unix time changes are stamped from, only set for a backfill
 
-    def execute(self):
+        # tombstones are swept by primary key, or by their change token for tables without one,
+        # soft deletes are compacted into a tombstones table rather than dropped
+        self.sweeper = None
+        if self.cnf.delete_behaviour == "HARD" or self.cnf.compact_tombstones:
+            self.sweeper = TombstoneSweeper(
+                self.db,
+                {
+                    table.table_name: (
+                        table.get_pk_field().name
+                        if table.get_pk_field()
+                        else "change_token"
+                    )
+                    for table in self.tables
+                },
+                self.cnf.sweep_every_ms,
+                self.cnf.sweep_threshold,
+                compact=self.cnf.delete_behaviour == "SOFT",
+            )
+
+        # tables without their own rate share the global rate, falling back to the fixed delay between actions
+        shared_tables = [table for table in self.tables if table.rate is None]
+        self.scheduler = Scheduler(
+            [Stream([table], table.rate) for table in self.tables if table.rate]
+            + [
+                Stream(
+                    shared_tables,
+                    self.cnf.rate or RateLimit.from_interval(self.cnf.inter_action_delay),
+                )
+            ]
+        )
+
+        # lookups on tables without a primary key can't follow their rows, and are left to SQL
+        for table in self.tables:
+            for imposter in table.get_imposters():
+                if imposter.imposter_type == ImposterType.TABLE_RANDOM:
+                    lookup = imposter.evaluate()
+                    pk_field = self.get_table(lookup.table).get_pk_field()
+                    if pk_field is not None:
+                        self.key_index.register(lookup.table, lookup.field, pk_field.name)
+
+    def get_table(self, table_name: str):
+        for table in self.tables:
+            if table.table_name == table_name:
+                return table
+        return None
+
+    def prepare(self):
+        """Create any missing tables and load the state needed to generate changes from the database"""
 
         self.cnf.create_output_folders([table.table_name for table in self.tables])
+        if self.journal is not None:
+            self.journal.prepare()
+        resumed = self.checkpoint is not None and self.checkpoint.load()
 
-        max_change_token_values = {}
         for table in self.tables:
             result = self.db.execute_sql(
                 f"select count(1) as cnt from information_schema.tables where table_name = '{table.table_name}'",
@@ -25,25 +143,293 @@ class SouthWind:
             )
             if result == "0":
                 self.db.execute_sql(table.genereate_create_table_str())
-            max_change_token_values[table.table_name] = self.db.get_max_change_token(
-                table.table_name
-            )
+            if self.sweeper is not None and self.sweeper.compact:
+                self.db.execute_sql(table.generate_create_tombstones_str())
+            increment_fields = [
+                field.name
+                for field in table.fields
+                if field.imposter.imposter_type == ImposterType.INCREMENT
+            ]
+            max_values = self.db.get_max_values(table.table_name, increment_fields)
+            if self.sweeper is not None and self.sweeper.compact:
+                # compacted rows keep their ids and change tokens, which mustn't be handed out again
+                archived = self.db.get_max_values(
+                    f"{table.table_name}_tombstones", increment_fields
+                )
+                max_values = {
+                    field_name: max(
+                        (value for value in (max_value, archived[field_name]) if value is not None),
+                        default=None,
+                    )
+                    for field_name, max_value in max_values.items()
+                }
+            # after a crash the tables can be behind the export (the memory backend's last snapshot),
+            # and change tokens already exported mustn't be handed out again
+            exported = self.checkpoint.change_token(table.table_name) if resumed else None
+            if exported is not None and exported > (max_values.get("change_token") or 0):
+                max_values["change_token"] = exported
+            for field_name, max_value in max_values.items():
+                self.sequences.register(
+                    table.table_name, field_name, (max_value or 0) + 1
+                )
+
+            indexed_fields = self.key_index.get_fields(table.table_name)
+            if indexed_fields:
+                self.key_index.apply(
+                    table.table_name,
+                    self.db.get_live_rows(table.table_name, indexed_fields),
+                )
+
+            pk_field = table.get_pk_field()
+            if self.journal is not None and pk_field is not None:
+                self.journal.track(
+                    table.table_name,
+                    pk_field.name,
+                    [field.name for field in table.fields],
+                )
+
+        if self.checkpoint is not None:
+            self.export_gap(resumed)
 
-        def handle_change(table_name: str):
-            max_change_token_value = self.db.get_latest_rows(table_name)
-            if max_change_token_value != max_change_token_values[table_name]:
-                max_change_token_values[table_name] = max_change_token_value
-                latest_row = self.db.get_latest_rows(table_name)
-                self.exporter.export(table_name, latest_row, self.cnf.output_format)
-
-            if self.cnf.delete_behaviour == "HARD":
-                for table in self.tables:
-                    self.db.execute_sql(
-                        f"delete from {table.table_name} where change_type = 'D'"
+        # before images are seeded once the gap is exported, so its changes aren't wrapped with their own images
+        if self.exporter.envelope is not None:
+            for table in self.tables:
+                if table.get_pk_field() is not None:
+                    self.exporter.envelope.track(
+                        table.table_name,
+                        self.db.get_live_rows(
+                            table.table_name, [field.name for field in table.fields]
+                        ),
                     )
 
-        while True:
+    def export_gap(self, resumed: bool):
+        """Export the changes committed after the checkpoint, those the last run didn't get into a complete file.
+        Incomplete files are removed and their changes exported again, each table's gap is streamed from the
+        database and completed in files of its own before any new changes. Without a checkpoint to resume from,
+        tables are checkpointed from their current state
+
+        Args:
+            resumed (bool): whether the checkpoint was loaded from the last run
+        """
+        self.exporter.discard_incomplete()
+        for table in self.tables:
+            table_name = table.table_name
+            if not resumed:
+                self.checkpoint.start(
+                    table_name, self.db.get_max_change_token(table_name)
+                )
+                continue
+            # compacted tombstones are still changes to export
+            source = (
+                f"{table_name}_history"
+                if self.sweeper is not None and self.sweeper.compact
+                else table_name
+            )
+            for rows in self.db.iter_rows_since(
+                source, self.checkpoint.change_token(table_name)
+            ):
+                self.export_committed((table_name, rows))
+            self.exporter.rotate(table_name)
+        self.checkpoint.save()
+
+    def export_changes(self, table_name: str, rows: List[Dict]):
+        """Export committed changes
+
+        Args:
+            table_name (str): table the rows belong to
+            rows (List[Dict]): changed rows
+        """
+        self.exporter.export(table_name, rows, self.cnf.output_format)
+
+    def export_committed(self, change: Tuple[str, List[Dict]]):
+        """Export a committed change
+
+        Args:
+            change (Tuple[str, List[Dict]]): table name and changed rows
+        """
+        self.export_changes(*change)
+
+    def file_completed(self, table_name: str, file: RollingFile, completed_through: int):
+        """Pass on the tombstones in a completed file to be swept, and move the checkpoint on.
+        Tombstones are only swept once the file they're in is complete, so a crash never loses a delete
+
+        Args:
+            table_name (str): table the file belongs to
+            file (RollingFile): completed file
+            completed_through (int): change token up to which all of the table's changes are in complete files
+        """
+        if self.sweeper is not None:
+            self.sweeper.exported(table_name, file.tombstones)
+        if self.checkpoint is not None:
+            self.checkpoint.completed(table_name, file, completed_through)
+
+    def handle_change(
+        self, table_name: str, changed_rows: List[Dict], event_timestamp: str = None
+    ):
+        """Handle the rows changed by the last action on a table
+
+        Args:
+            table_name (str): table acted on
+            changed_rows (List[Dict]): rows returned by the action's statements
+            event_timestamp (str, optional): simulated time of the action, added to the exported rows. Defaults to None.
+        """
+        if changed_rows:
+            self.key_index.apply(table_name, changed_rows)
+            if self.journal is not None:
+                self.journal.record(table_name, changed_rows)
+                if not self.transactions.in_transaction:
+                    self.journal.flush()
+            if event_timestamp is not None:
+                # the journal keeps the rows it records as images of the table, so only exported copies are stamped
+                changed_rows = [
+                    dict(row, event_timestamp=event_timestamp) for row in changed_rows
+                ]
+            # exported once committed
+            self.transactions.add_changes(table_name, changed_rows)
+
+    def apply_action(self, action: Tuple[str, List[Statement], str]):
+        """Apply the statements of an action and capture the changes they made
+
+        Args:
+            action (Tuple[str, List[Statement], str]): table acted on, the statements to execute and the simulated time of the action
+        """
+        table_name, statements, event_timestamp = action
+        self.transactions.begin()
+        self.handle_change(table_name, self.db.execute(statements), event_timestamp)
+        self.transactions.action_completed()
+        if self.sweeper is not None and self.sweeper.due():
+            self.sweeper.sweep(self.transactions.in_transaction)
+        if self.db.snapshot_due():
+            self.db.snapshot()
+
+    def commit_expired(self):
+        """Commit the open transaction once it's older than `commit_every_ms`, even while no actions arrive"""
+        self.transactions.commit_expired()
+
+    def end_apply(self, completed: bool):
+        """Commit the open transaction once all actions are applied, or roll it back if anything failed
+
+        Args:
+            completed (bool): whether all actions were generated and applied
+        """
+        if completed:
+            self.transactions.commit()
+        else:
+            self.transactions.rollback()
+            if self.journal is not None:
+                self.journal.discard()
+
+    def stop(self, completed: bool):
+        """Drain the stages, in order
+
+        Args:
+            completed (bool): whether generation stopped cleanly
+        """
+        try:
+            self.apply_stage.stop(completed)
+            self.export_stage.stop(completed)
+            self.exporter.close()
+            # sweep the tombstones exported since the apply stage stopped
+            if self.sweeper is not None:
+                self.sweeper.sweep()
+            self.db.snapshot()
+        finally:
             for table in self.tables:
-                self.db.execute(table.perform_action())
-                handle_change(table.table_name)
-                time.sleep(self.cnf.inter_action_delay)
+                for field in table.fields:
+                    field.imposter.close()
+            pool.shutdown()
+
+    def event_timestamp(self) -> str:
+        """Simulated time of the current action, None outside of a backfill"""
+        if self.event_start is None:
+            return None
+        return datetime.fromtimestamp(
+            self.event_start + self.scheduler.elapsed(), timezone.utc
+        ).isoformat(timespec="milliseconds")
+
+    def finish(self):
+        """Apply any changes still staged for a batch update, then commit and drain the stages"""
+        for table in self.tables:
+            if table.pending_changes:
+                self.apply_stage.put(
+                    (table.table_name, table.flush_changes(), self.event_timestamp())
+                )
+        self.stop(completed=True)
+        self.apply_stage.raise_error()
+        self.export_stage.raise_error()
+
+    def run(self, events: int = None, duration_s: float = None):
+        """Perform actions until interrupted, or until a number of events or span of scheduler time is reached
+
+        Args:
+            events (int, optional): number of actions to perform. Defaults to None.
+            duration_s (float, optional): seconds of scheduler time to run for. Defaults to None.
+        """
+        self.apply_stage.start()
+        self.export_stage.start()
+        performed = 0
+        try:
+            while events is None or performed < events:
+                self.apply_stage.raise_error()
+                self.export_stage.raise_error()
+                table = self.scheduler.next()
+                if duration_s is not None and self.scheduler.elapsed() >= duration_s:
+                    break
+                self.apply_stage.put(
+                    (table.table_name, table.perform_action(), self.event_timestamp())
+                )
+                performed += 1
+        except Exception:
+            self.stop(completed=False)
+            raise
+        except KeyboardInterrupt:
+            self.finish()
+            raise
+        self.finish()
+
+    def backfill(
+        self, events: int = None, duration_s: float = None, start: float = None
+    ):
+        """Generate history as fast as possible, with the scheduler running on a simulated clock.
+        Each exported change is stamped with an `event_timestamp` of when it happened in simulated time,
+        and actions are grouped into transactions so changes are applied and exported in bulk
+
+        Args:
+            events (int, optional): number of actions to perform. Defaults to None.
+            duration_s (float, optional): seconds of simulated time to generate. Defaults to None.
+            start (float, optional): unix time the history starts at. Defaults to duration_s before now, or now.
+
+        Raises:
+            InvalidConfigSettingError: if neither events nor duration are given, or a duration is given without rates to pace it
+        """
+        if events is None and duration_s is None:
+            raise InvalidConfigSettingError(
+                "A backfill needs a number of events and/or a duration"
+            )
+        if duration_s is not None and any(
+            stream.limit.events_per_second is None for stream in self.scheduler.streams
+        ):
+            raise InvalidConfigSettingError(
+                "A backfill over a duration needs every table to be paced, by a rate or inter_action_delay"
+            )
+
+        clock = VirtualClock()
+        self.scheduler.clock = clock.now
+        self.scheduler.sleep = clock.sleep
+        if start is None:
+            start = time.time() - (duration_s or 0)
+        self.event_start = start
+        if not self.transactions.enabled:
+            self.transactions = TransactionBatcher(
+                self.db,
+                self.transactions.on_commit,
+                SouthWind.BACKFILL_COMMIT_EVERY,
+                before_commit=self.transactions.before_commit,
+            )
+
+        self.prepare()
+        self.run(events, duration_s)
+
+    def execute(self):
+        self.prepare()
+        self.run()
@@ -0,0 +1,144 @@
+from typing import Callable, Dict, List
+import json
+import os
+import socket
+import stat
+import struct
+
+from .envelope import DebeziumEnvelope
+from .exceptions import InvalidConfigSettingError
+
+
+class StreamBatch:
+    """Records written to a stream in one go, reported like a completed file once the consumer has them"""
+
+    def __init__(self, path: str, values: List[Dict]):
+        """Init the batch
+
+        Args:
+            path (str): address of the stream
+            values (List[Dict]): records in the batch
+        """
+        tokens = [row["change_token"] for row in values if "change_token" in row]
+        self.path = path
+        self.format = "json"
+        self.records = len(values)
+        self.min_change_token = int(min(tokens)) if tokens else None
+        self.max_change_token = int(max(tokens)) if tokens else None
+        self.tombstones = [row for row in values if row.get("change_type") == "D"]
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(path={self.path}, records={self.records})"
+
+
+class StreamExporter:
+    """Streams changes to a local consumer, over a Unix domain socket, a TCP connection or a FIFO, in place of files.
+    Each record is a frame of a 4 byte big-endian length followed by that many bytes of UTF-8 JSON,
+    `{"table": <table>, "row": <record>}`. The records of each export are written as one batch of frames.
+    Writes block while the consumer isn't keeping up, holding back the export stage and, through the bounded
+    pipeline queues, the generation of new changes.
+    The stream is connected on the first export, so a FIFO doesn't block until there are changes to send
+    """
+
+    TYPES = ["unix", "tcp", "fifo"]
+
+    def __init__(
+        self,
+        type: str,
+        address: str,
+        on_complete: Callable[[str, StreamBatch, int], None] = None,
+        envelope: DebeziumEnvelope = None,
+    ):
+        """Init the exporter
+
+        Args:
+            type (str): stream type, either 'unix', 'tcp' or 'fifo'
+            address (str): socket or FIFO path, `<host>:<port>` for tcp
+            on_complete (Callable[[str, StreamBatch, int], None], optional): called once a batch is written with the table,
+                the batch and its greatest change token. Defaults to None.
+            envelope (DebeziumEnvelope, optional): wraps rows in change events before they're sent, the event taking the place of `row`. Defaults to None.
+        """
+        self.type = type
+        self.address = address
+        self.on_complete = on_complete
+        self.envelope = envelope
+        self.records = 0
+        self._stream = None
+
+    def _connect(self):
+        if self.type == "fifo":
+            if not os.path.exists(self.address):
+                os.mkfifo(self.address)
+            elif not stat.S_ISFIFO(os.stat(self.address).st_mode):
+                raise InvalidConfigSettingError(f"Stream address {self.address} is not a FIFO")
+            return open(self.address, "wb")
+        if self.type == "unix":
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.address)
+        else:
+            host, port = self.address.rsplit(":", 1)
+            sock = socket.create_connection((host, int(port)))
+        stream = sock.makefile("wb")
+        sock.close()  # the file keeps the connection open
+        return stream
+
+    def export(self, table_name: str, values: List[Dict], format: str) -> None:
+        """Write records to the stream, blocking until the consumer has taken them
+
+        Args:
+            table_name (str): table the records belong to
+            values (List[Dict]): records to send
+            format (str): export format, only 'json' can be streamed
+
+        Raises:
+            NotImplementedError: If not json
+        """
+        if format.lower() != "json":
+            raise NotImplementedError()
+        if not values:
+            return
+        if self._stream is None:
+            self._stream = self._connect()
+
+        records = (
+            self.envelope.wrap(table_name, values) if self.envelope is not None else values
+        )
+        frames = []
+        for row in records:
+            payload = _to_json(table_name, row).encode("utf-8")
+            frames.append(struct.pack(">I", len(payload)))
+            frames.append(payload)
+        self._stream.write(b"".join(frames))
+        self._stream.flush()
+        self.records += len(values)
+        if self.on_complete is not None:
+            batch = StreamBatch(self.address, values)
+            self.on_complete(table_name, batch, batch.max_change_token)
+
+    def rotate(self, table_name: str) -> None:
+        """Nothing is held back, batches are complete once written"""
+
+    def rotate_expired(self) -> None:
+        """Nothing is held back, batches are complete once written"""
+
+    def discard_incomplete(self) -> int:
+        """Nothing is left incomplete by a stream
+
+        Returns:
+            int: number of files removed, always 0
+        """
+        return 0
+
+    def close(self) -> None:
+        """Close the stream, the consumer sees the end of it"""
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(type={self.type}, address={self.address}, records={self.records})"
+
+
+def _to_json(table_name: str, row: Dict) -> str:
+    """Serialise a frame"""
+    return json.dumps({"table": table_name, "row": row}, default=str)
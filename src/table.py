@@ -1,4 +1,4 @@
-from typing import List, Union
+from typing import Any, List, Union
 import logging
 import random
 
@@ -6,13 +6,25 @@ from .exceptions import InvalidValueError
 
 from .field import Field
 from .imposter import (
+    Imposter,
+    ImposterType,
     ImposterResult,
     ImposterDirectResult,
     ImposterLookupResult,
     ImposterIncrementResult,
 )
 from .action import Action, Set, Create, Remove
-from .db_connector import Statement, SQLStatement, DirectStatement
+from .db_connector import (
+    Statement,
+    SQLStatement,
+    InsertStatement,
+    BulkInsertStatement,
+    BatchUpdateStatement,
+    UpdateStatement,
+)
+from .key_index import KeyIndex
+from .sequence import SequenceAllocator
+from .scheduler import RateLimit
 
 
 logger = logging.getLogger()
@@ -22,7 +34,16 @@ logger.setLevel(logging.INFO)
 class Table:
     """Table class to represent a table in the database, with fields and actions to perform on the table"""
 
-    def __init__(self, table_name: str, fields: List[Field], actions: List[Action]):
+    def __init__(
+        self,
+        table_name: str,
+        fields: List[Field],
+        actions: List[Action],
+        key_index: KeyIndex = None,
+        sequences: SequenceAllocator = None,
+        change_batch_size: int = 1,
+        rate: RateLimit = None,
+    ):
         self.table_name = table_name
         self.fields = fields + [
             Field(
@@ -33,6 +54,11 @@ class Table:
             ),  # used as a flag to track change type (D, U, I)
         ]
         self.actions = actions
+        self.key_index = key_index  # resolves table_random lookups in memory when set
+        self.sequences = sequences  # hands out increment values in memory when set
+        self.change_batch_size = change_batch_size
+        self.pending_changes = []  # staged (action, where value, set value) awaiting a batch update
+        self.rate = rate  # table specific rate, otherwise the table shares the global rate
 
     def generate_count_str(self, table: str) -> str:
         """Generate a count query for a table
@@ -61,17 +87,18 @@ class Table:
         """
         return f"""select {field} from {table} where change_type != 'D' using sample 1 union all (select {default_val} as {field} order by {field} desc)"""  # handles for empty table and filters deleted records
 
-    def generate_increment_str(self, table: str, field: str) -> str:
+    def generate_increment_str(self, table: str, field: str, offset: int = 0) -> str:
         """Gets the max of a field and increments it by 1, used for auto incrementing fields
 
         Args:
             table (str): table name
             field (str): field to get autoincrement of.
+            offset (int, optional): added to the increment, for rows inserted by the same statement. Defaults to 0.
 
         Returns:
             str: SQL query
         """
-        return f"""select coalesce((max({field}) + 1), 1) as inc from {table};"""  # not filtering out deleted records as we don't want to reuse the deleted record's id
+        return f"""select coalesce((max({field}) + {offset + 1}), {offset + 1}) as inc from {table};"""  # not filtering out deleted records as we don't want to reuse the deleted record's id
 
     def genereate_create_table_str(self) -> str:
         """generate DDL
@@ -84,56 +111,111 @@ class Table:
             {', '.join(' '.join([field.name, field.type]) + (' primary key' if field.is_pk else '') for field in self.fields)});
         """
 
-    def evaluate_imposter(self, field: Field) -> Statement:
-        """Evaluate the imposter field and return the appropriate Statement type
+    def generate_create_tombstones_str(self) -> str:
+        """generate DDL of the table soft deleted rows are compacted into, and a view of the table's full history
+
+        Returns:
+            str: SQL query
+        """
+        return f"""
+        CREATE TABLE if not exists {self.table_name}_tombstones(
+            {', '.join(' '.join([field.name, field.type]) for field in self.fields)});
+        CREATE VIEW if not exists {self.table_name}_history AS
+            SELECT * FROM {self.table_name} UNION ALL SELECT * FROM {self.table_name}_tombstones;
+        """
+
+    def evaluate_imposter(
+        self, field: Field, result: ImposterResult = None, offset: int = 0
+    ) -> Any:
+        """Evaluate the imposter of a field and return the value to bind as a statement parameter
 
         Args:
-            field (Field): _description_
+            field (Field): field the value is generated for, the value is cast to its type
+            result (ImposterResult, optional): already evaluated result of the field. Defaults to None.
+            offset (int, optional): row offset within the statement, used for increments. Defaults to 0.
 
         Raises:
-            InvalidValueError: _description_
+            InvalidValueError: if the imposter result isn't recognised
 
         Returns:
-            Statement: _description_
+            Any: value, or a SQLStatement if it has to be looked up from the database
         """
-        result = field.evaluate()
+        if result is None:
+            result = field.evaluate()
 
         if isinstance(result, ImposterDirectResult):
-            return DirectStatement(result.value)
+            value = result.value
 
         elif isinstance(result, ImposterLookupResult):
-            return SQLStatement(
-                self.generate_random_lookup_str(
-                    result.table, result.field, result.default_val
-                ),
-                result.field,
-            )
+            if self.key_index is None or (result.table, result.field) not in self.key_index:
+                return SQLStatement(
+                    self.generate_random_lookup_str(
+                        result.table, result.field, result.default_val
+                    ),
+                    result.field,
+                )
+            value = self.key_index.sample(result.table, result.field, result.default_val)
 
         elif isinstance(result, ImposterIncrementResult):
-            return SQLStatement(
-                self.generate_increment_str(self.table_name, field.name), "inc"
-            )
+            if self.sequences is None or (self.table_name, field.name) not in self.sequences:
+                return SQLStatement(
+                    self.generate_increment_str(self.table_name, field.name, offset),
+                    "inc",
+                )
+            value = self.sequences.next(self.table_name, field.name)
 
         else:
             raise InvalidValueError("Invalid value")
 
-    def generate_insert(self) -> List[Statement]:
-        """Generate List of statements for insert
+        return field.cast(value) if field is not None else value
+
+    def evaluate_column(self, field: Field, rows: int) -> List[Any]:
+        """Evaluate the imposter of a field for a batch of rows
+
+        Args:
+            field (Field): field to generate values for
+            rows (int): number of rows in the batch
+
+        Returns:
+            List[Any]: value per row
+        """
+        if field.name == "change_token":
+            # the whole batch is a single change
+            return [self.evaluate_imposter(field)] * rows
+        if (
+            field.imposter.imposter_type == ImposterType.INCREMENT
+            and self.sequences is not None
+            and (self.table_name, field.name) in self.sequences
+        ):
+            return list(self.sequences.reserve(self.table_name, field.name, rows))
+        return [
+            self.evaluate_imposter(field, result, row)
+            for row, result in enumerate(field.evaluate_batch(rows))
+        ]
+
+    def generate_insert(self, rows: int = 1) -> List[Statement]:
+        """Generate List of statements for insert, batches of more than one row are inserted in bulk
+        Args:
+            rows (int, optional): number of rows to insert. Defaults to 1.
         Returns:
             List[Statement]: List of Statemet objects
         """
-        result_values = []
-        for field in self.fields:
-            result_values.append(DirectStatement(f"'"))
-            result_values.append(self.evaluate_imposter(field))
-            result_values.append(
-                DirectStatement("', " if field != self.fields[-1] else "'")
+        columns = {field.name: self.evaluate_column(field, rows) for field in self.fields}
+        if rows > 1:
+            return [BulkInsertStatement(self.table_name, columns)]
+        return [
+            InsertStatement(
+                self.table_name,
+                list(columns),
+                [tuple(column[0] for column in columns.values())],
             )
-        return (
-            [DirectStatement(f"INSERT INTO {self.table_name} VALUES (")]
-            + result_values
-            + [DirectStatement(");")]
-        )
+        ]
+
+    def _get_where_field(self, action: Union[Set, Remove]) -> Field:
+        """Field of the table matched by an action's where condition, used to type the where value"""
+        if action.where_table != self.table_name:
+            return None
+        return self.get_field_by_name(action.where_field)
 
     def generate_set(self, action: Set) -> List[Statement]:
         """Generate List of statements for set
@@ -142,26 +224,31 @@ class Table:
         Returns:
             List[Statement]: List of Statement objects
         """
-
-        result_values = [
-            DirectStatement(f"UPDATE {self.table_name} set {action.field} = '")
-        ]
-        result_values.append(self.evaluate_imposter(action.value))
+        assignments = {
+            action.field: self.evaluate_imposter(
+                self.get_field_by_name(action.field), action.value.evaluate_batch(1)[0]
+            ),
+            "change_token": self.evaluate_imposter(
+                self.get_field_by_name("change_token")
+            ),
+            "change_type": "U",
+        }
 
         if action.where_clause is not None:
-            return result_values + [
-                DirectStatement(
-                    f"', change_token = (SELECT MAX(change_token) + 1 FROM {self.table_name}), change_type = 'U' WHERE {action.where_table}.{action.where_field} {action.where_condition} '"
-                ),
-                self.evaluate_imposter(action.where_value),
-                DirectStatement("' AND change_type != 'D';"),
-            ]
-        else:
-            return result_values + [
-                DirectStatement(
-                    f"', change_token = (SELECT MAX(change_token) + 1 FROM {self.table_name}), change_type = 'U' WHERE change_type != 'D';"
+            return [
+                UpdateStatement(
+                    self.table_name,
+                    assignments,
+                    action.where_field,
+                    action.where_condition,
+                    self.evaluate_imposter(
+                        self._get_where_field(action),
+                        action.where_value.evaluate_batch(1)[0],
+                    ),
                 )
             ]
+        else:
+            return [UpdateStatement(self.table_name, assignments)]
 
     def generate_delete(self, action: Remove) -> List[Statement]:
         """Generate List of statements for delete
@@ -170,16 +257,96 @@ class Table:
         Returns:
             List[Statement]: List of Statement objects
         """
-
-        return [
-            DirectStatement(
-                f"UPDATE {self.table_name} SET change_token = (SELECT MAX(change_token) + 1 FROM {self.table_name}), change_type = 'D' WHERE {action.where_table}.{action.where_field} {action.where_condition} '"
+        assignments = {
+            "change_token": self.evaluate_imposter(
+                self.get_field_by_name("change_token")
             ),
-            self.evaluate_imposter(action.where_value),
-            DirectStatement(
-                "' AND change_type != 'D';"
-            ),  # probably not need, but will leave in for now
-        ]
+            "change_type": "D",
+        }
+
+        if action.where_clause is not None:
+            return [
+                UpdateStatement(
+                    self.table_name,
+                    assignments,
+                    action.where_field,
+                    action.where_condition,
+                    self.evaluate_imposter(
+                        self._get_where_field(action),
+                        action.where_value.evaluate_batch(1)[0],
+                    ),
+                )
+            ]
+        else:
+            return [UpdateStatement(self.table_name, assignments)]
+
+    def is_batchable(self, action: Action) -> bool:
+        """Whether an action can be staged and applied as part of a batch update,
+        only Set and Remove actions matching rows on equality of a field of this table are
+
+        Args:
+            action (Action): action to check
+
+        Returns:
+            bool: True if the action can be batched
+        """
+        return (
+            self.change_batch_size > 1
+            and isinstance(action, (Set, Remove))
+            and action.where_clause is not None
+            and action.where_condition == "=="
+            and action.where_table == self.table_name
+        )
+
+    def stage_change(self, action: Union[Set, Remove]) -> None:
+        """Evaluate a batchable action and stage it for the next batch update
+
+        Args:
+            action (Union[Set, Remove]): action to stage
+        """
+        where_value = self.evaluate_imposter(
+            self._get_where_field(action), action.where_value.evaluate_batch(1)[0]
+        )
+        set_value = None
+        if isinstance(action, Set):
+            set_value = self.evaluate_imposter(
+                self.get_field_by_name(action.field), action.value.evaluate_batch(1)[0]
+            )
+        self.pending_changes.append((action, where_value, set_value))
+
+    def flush_changes(self) -> List[Statement]:
+        """Generate the batch updates applying the staged changes, one per set field and where field.
+        Sets are applied before removes, and only the last change staged for a key is kept per batch update.
+        Change tokens are assigned when flushing so they follow any changes made while the batch was staged.
+
+        Returns:
+            List[Statement]: List of Statement objects
+        """
+        groups = {}
+        for action, where_value, set_value in self.pending_changes:
+            set_field = action.field if isinstance(action, Set) else None
+            group = groups.setdefault((set_field is None, set_field, action.where_field), {})
+            group.pop(where_value, None)  # re-insert so the key keeps the order of its last change
+            group[where_value] = set_value
+        self.pending_changes = []
+
+        token_field = self.get_field_by_name("change_token")
+        statements = []
+        for (is_remove, set_field, where_field), changes in sorted(
+            groups.items(), key=lambda group: group[0][0]
+        ):
+            columns = {}
+            if not is_remove:
+                columns[set_field] = list(changes.values())
+            columns["change_token"] = [
+                self.evaluate_imposter(token_field, None, offset)
+                for offset in range(len(changes))
+            ]
+            columns["change_type"] = ["D" if is_remove else "U"] * len(changes)
+            statements.append(
+                BatchUpdateStatement(self.table_name, where_field, list(changes), columns)
+            )
+        return statements
 
     def perform_action(self) -> List[Statement]:
         """Perform a random action on a table
@@ -194,12 +361,20 @@ class Table:
             self.actions, [action.frequency for action in self.actions]
         )[0]
 
+        if self.is_batchable(selected_action):
+            self.stage_change(selected_action)
+            if len(self.pending_changes) >= self.change_batch_size:
+                return self.flush_changes()
+            return []
+
+        # apply anything staged first so changes keep their order
+        pending = self.flush_changes() if self.pending_changes else []
         if isinstance(selected_action, Set):
-            return self.generate_set(selected_action)
+            return pending + self.generate_set(selected_action)
         elif isinstance(selected_action, Create):
-            return self.generate_insert()
+            return pending + self.generate_insert(selected_action.batch_size)
         elif isinstance(selected_action, Remove):
-            return self.generate_delete(selected_action)
+            return pending + self.generate_delete(selected_action)
         else:
             raise NotImplementedError()
 
@@ -209,6 +384,26 @@ class Table:
                 return field
         return None
 
+    def get_pk_field(self) -> Field:
+        for field in self.fields:
+            if field.is_pk:
+                return field
+        return None
+
+    def get_imposters(self) -> List[Imposter]:
+        """All imposters used by the table's fields and actions
+
+        Returns:
+            List[Imposter]: list of Imposter objects
+        """
+        imposters = [field.imposter for field in self.fields]
+        for action in self.actions:
+            if isinstance(action, Set):
+                imposters.append(action.value)
+            if isinstance(action, (Set, Remove)) and action.where_clause is not None:
+                imposters.append(action.where_value)
+        return imposters
+
     def __str__(self):
         return f"{self.table_name} {self.fields} {self.actions}"
 
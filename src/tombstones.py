@@ -0,0 +1,111 @@
+from typing import Any, Dict, List
+import threading
+import time
+
+from .db_connector import DBConnector
+
+
+class TombstoneSweeper:
+    """Hard deletes the tombstones (rows with a change type of 'D') left by deletes, once they've been exported.
+    Exported tombstones are collected by key, the table's primary key or the change token for tables without one,
+    and deleted by key once either enough have built up or the sweep interval has passed.
+    When compacting, tombstones are moved into `<table>_tombstones` rather than dropped.
+    Tombstones are reported from the export stage and swept from the apply stage, so the collected keys are locked.
+    """
+
+    DEFAULT_EVERY_MS = 1000
+    DEFAULT_THRESHOLD = 1000
+
+    def __init__(
+        self,
+        db: DBConnector,
+        key_fields: Dict[str, str],
+        every_ms: int = None,
+        threshold: int = None,
+        compact: bool = False,
+    ):
+        """Init the sweeper
+
+        Args:
+            db (DBConnector): database to delete from
+            key_fields (Dict[str, str]): field identifying a tombstone per table
+            every_ms (int, optional): max time between sweeps in milliseconds. Defaults to DEFAULT_EVERY_MS if neither limit is set.
+            threshold (int, optional): number of exported tombstones that triggers a sweep. Defaults to DEFAULT_THRESHOLD if neither limit is set.
+            compact (bool, optional): move tombstones into the table's tombstones table rather than dropping them. Defaults to False.
+        """
+        if every_ms is None and threshold is None:
+            every_ms = TombstoneSweeper.DEFAULT_EVERY_MS
+            threshold = TombstoneSweeper.DEFAULT_THRESHOLD
+        self.db = db
+        self.key_fields = key_fields
+        self.every_ms = every_ms
+        self.threshold = threshold
+        self.compact = compact
+        self.swept = 0
+
+        self._exported: Dict[str, List[Any]] = {table: [] for table in key_fields}
+        self._count = 0
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+
+    def exported(self, table_name: str, rows: List[Dict]) -> None:
+        """Collect the tombstones among exported rows
+
+        Args:
+            table_name (str): table the rows belong to
+            rows (List[Dict]): exported rows
+        """
+        key_field = self.key_fields[table_name]
+        keys = [row[key_field] for row in rows if row.get("change_type") == "D"]
+        if keys:
+            with self._lock:
+                self._exported[table_name].extend(keys)
+                self._count += len(keys)
+
+    def due(self) -> bool:
+        """Whether enough tombstones have built up, or enough time has passed, to sweep"""
+        if self.threshold is not None and self._count >= self.threshold:
+            return True
+        return (
+            self.every_ms is not None
+            and self._count > 0
+            and (time.monotonic() - self._last_sweep) * 1000 >= self.every_ms
+        )
+
+    def sweep(self, in_transaction: bool = False) -> int:
+        """Delete the exported tombstones collected so far.
+        Outside of a transaction a compacting sweep runs in one of its own, so rows are never in both tables
+
+        Args:
+            in_transaction (bool, optional): whether a transaction is already open. Defaults to False.
+
+        Returns:
+            int: number of rows deleted
+        """
+        with self._lock:
+            exported = self._exported
+            self._exported = {table: [] for table in self.key_fields}
+            self._count = 0
+        self._last_sweep = time.monotonic()
+
+        if not any(exported.values()):
+            return 0
+        own_transaction = self.compact and not in_transaction
+        if own_transaction:
+            self.db.begin()
+        deleted = 0
+        for table_name, keys in exported.items():
+            if keys:
+                deleted += self.db.delete_tombstones(
+                    table_name,
+                    self.key_fields[table_name],
+                    keys,
+                    f"{table_name}_tombstones" if self.compact else None,
+                )
+        if own_transaction:
+            self.db.commit()
+        self.swept += deleted
+        return deleted
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(every_ms={self.every_ms}, threshold={self.threshold}, compact={self.compact}, pending={self._count}, swept={self.swept})"
@@ -0,0 +1,109 @@
+from typing import Callable, Dict, List, Tuple
+import time
+
+from .db_connector import DBConnector
+
+
+class TransactionBatcher:
+    """Groups actions into explicit transactions, committing every n actions and/or every n milliseconds.
+    Changes captured within a transaction are held back and only handed on once it has committed,
+    combined into a single batch of rows per table.
+    With neither setting, statements autocommit and changes are handed on straight away.
+    """
+
+    def __init__(
+        self,
+        db: DBConnector,
+        on_commit: Callable[[str, List[Dict]], None],
+        every_n_actions: int = None,
+        every_ms: int = None,
+        before_commit: Callable[[], None] = None,
+    ):
+        """Init the batcher
+
+        Args:
+            db (DBConnector): connector the transactions are run on
+            on_commit (Callable[[str, List[Dict]], None]): called with the table name and rows of each committed change
+            every_n_actions (int, optional): actions per transaction. Defaults to None.
+            every_ms (int, optional): max age of a transaction in milliseconds. Defaults to None.
+            before_commit (Callable[[], None], optional): called within the transaction just before it commits. Defaults to None.
+        """
+        self.db = db
+        self.on_commit = on_commit
+        self.before_commit = before_commit
+        self.every_n_actions = every_n_actions
+        self.every_ms = every_ms
+        self.enabled = every_n_actions is not None or every_ms is not None
+
+        self.in_transaction = False
+        self._actions = 0
+        self._started = 0.0
+        self._changes: List[Tuple[str, List[Dict]]] = []
+
+    def add_changes(self, table_name: str, rows: List[Dict]) -> None:
+        """Add changes captured in the current transaction
+
+        Args:
+            table_name (str): table the rows belong to
+            rows (List[Dict]): changed rows
+        """
+        if self.in_transaction:
+            self._changes.append((table_name, rows))
+        else:
+            self.on_commit(table_name, rows)
+
+    def begin(self) -> None:
+        """Start a transaction if batching is enabled and one isn't already open"""
+        if not self.enabled or self.in_transaction:
+            return
+        self.db.begin()
+        self.in_transaction = True
+        self._actions = 0
+        self._started = time.monotonic()
+
+    def action_completed(self) -> None:
+        """Record an action within the transaction, committing once a limit is reached"""
+        if not self.in_transaction:
+            return
+        self._actions += 1
+        if (
+            self.every_n_actions is not None and self._actions >= self.every_n_actions
+        ) or self._expired():
+            self.commit()
+
+    def commit_expired(self) -> None:
+        """Commit the open transaction if it's been open for longer than `every_ms`, for when no actions arrive"""
+        if self.in_transaction and self._expired():
+            self.commit()
+
+    def _expired(self) -> bool:
+        return (
+            self.every_ms is not None
+            and (time.monotonic() - self._started) * 1000 >= self.every_ms
+        )
+
+    def commit(self) -> None:
+        """Commit the open transaction and hand on the changes made within it"""
+        if not self.in_transaction:
+            return
+        if self.before_commit is not None:
+            self.before_commit()
+        self.db.commit()
+        self.in_transaction = False
+        changes, self._changes = self._changes, []
+        combined: Dict[str, List[Dict]] = {}
+        for table_name, rows in changes:
+            combined.setdefault(table_name, []).extend(rows)
+        for table_name, rows in combined.items():
+            self.on_commit(table_name, rows)
+
+    def rollback(self) -> None:
+        """Roll back the open transaction, discarding the changes made within it"""
+        if not self.in_transaction:
+            return
+        self.db.rollback()
+        self.in_transaction = False
+        self._changes = []
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(every_n_actions={self.every_n_actions}, every_ms={self.every_ms})"
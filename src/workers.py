@@ -0,0 +1,481 @@
+from typing import Any, Callable, Dict, List, Tuple
+from pathlib import Path
+import bisect
+import heapq
+import itertools
+import logging
+import multiprocessing
+import random
+import signal
+import time
+
+from . import imposter
+from .checkpoint import ExportCheckpoint
+from .config import Config
+from .db_connector import DBConnector
+from .exporter import RollingFile
+from .imposter import ImposterType
+from .journal import ChangeJournal
+from .sequence import SequenceAllocator
+from .southwind import SouthWind
+from .tombstones import TombstoneSweeper
+
+
+logger = logging.getLogger()
+
+
+def shard_db_path(db_path: str, shard: int) -> str:
+    """Database file of a shard, alongside the configured database e.g. `southern_gale_shard0.db`
+
+    Args:
+        db_path (str): configured database path
+        shard (int): shard number
+
+    Returns:
+        str: shard database path
+    """
+    path = Path(db_path)
+    return str(path.with_name(f"{path.stem}_shard{shard}{path.suffix}"))
+
+
+class ShardWorker(SouthWind):
+    """Generates changes for all tables on its own shard of the database.
+    Increment values come from counters shared with the other workers, so ids and change tokens are unique across shards,
+    and committed changes are sent to the coordinator rather than exported directly.
+    Heartbeats are sent along with the changes, with the greatest change token per table the worker won't send changes
+    at or below again, so tables the worker rarely changes don't hold back their exports.
+    Tombstones are only swept once the coordinator has them in complete files, as it reports through shared counters
+    """
+
+    # how long to wait for the other workers to seed the shared counters
+    SEED_TIMEOUT = 300
+    # seconds between heartbeats
+    HEARTBEAT_S = 1.0
+
+    def __init__(
+        self,
+        config_path: str,
+        shard: int,
+        counters: Dict[Tuple[str, str], Any],
+        barrier: Any,
+        changes: Any,
+        resume: Any,
+        completed: Dict[str, Any],
+    ):
+        """Init the worker
+
+        Args:
+            config_path (str): path to config file
+            shard (int): shard number
+            counters (Dict[Tuple[str, str], Any]): shared counter per increment field
+            barrier (Any): barrier passed once every worker has seeded the shared counters
+            changes (Any): queue committed changes and heartbeats are sent on
+            resume (Any): event cleared while the coordinator holds too many changes, pausing generation
+            completed (Dict[str, Any]): shared change token per table up to which the coordinator has all changes in complete files
+        """
+        cnf = Config(config_path)
+        super().__init__(
+            config_path,
+            shard_db_path(cnf.db_path, shard),
+            SequenceAllocator(cnf.increment_block_size, counters),
+        )
+        self.shard = shard
+        self.counters = counters
+        self.barrier = barrier
+        self.changes = changes
+        self.resume = resume
+        self.completed = completed
+        self.checkpoint = None  # the coordinator owns the checkpoint, and exports the gap before workers start
+        self.heartbeat = None  # latest heartbeat applied, held back while a transaction is open
+        self._heartbeat_at = 0.0
+        # tombstones sent to the coordinator and not yet in a complete file, in change token order
+        self._unconfirmed = {table.table_name: [] for table in self.tables}
+
+    def queue_heartbeat(self, flush: bool = False):
+        """Queue a heartbeat behind the actions generated so far. Change tokens are only handed out on the generating
+        thread, so the actions generated after it only get tokens greater than the shared counters are at now
+
+        Args:
+            flush (bool, optional): commit the open transaction once the heartbeat is applied. Defaults to False.
+        """
+        watermarks = {
+            table.table_name: self.counters[(table.table_name, "change_token")].value - 1
+            for table in self.tables
+        }
+        self.apply_stage.put((None, watermarks, flush))
+        self._heartbeat_at = time.monotonic()
+
+    def next_table(self, next_table: Callable[[], Any]) -> Any:
+        """Wait for the next action, pausing while the coordinator catches up and sending heartbeats between actions
+
+        Args:
+            next_table (Callable[[], Any]): the scheduler's own next
+
+        Returns:
+            Any: table to act on
+        """
+        while not self.resume.is_set():
+            # the changes held back by open transactions may be the ones the coordinator is waiting on
+            self.queue_heartbeat(flush=True)
+            self.resume.wait(ShardWorker.HEARTBEAT_S)
+        if time.monotonic() - self._heartbeat_at >= ShardWorker.HEARTBEAT_S:
+            self.queue_heartbeat()
+        return next_table()
+
+    def sleep(self, sleep: Callable[[float], None], seconds: float):
+        """Sleep until the next action is due, sending heartbeats meanwhile
+
+        Args:
+            sleep (Callable[[float], None]): the scheduler's own sleep
+            seconds (float): seconds to sleep for
+        """
+        end = time.monotonic() + seconds
+        remaining = seconds
+        while remaining > 0:
+            sleep(min(remaining, ShardWorker.HEARTBEAT_S))
+            if time.monotonic() - self._heartbeat_at >= ShardWorker.HEARTBEAT_S:
+                self.queue_heartbeat()
+            remaining = end - time.monotonic()
+
+    def apply_action(self, action: Tuple[str, Any, Any]):
+        table_name, watermarks, flush = action
+        if table_name is None:
+            self.heartbeat = watermarks
+            if flush:
+                self.transactions.commit()
+        else:
+            super().apply_action(action)
+        self.send_heartbeat()
+
+    def commit_expired(self):
+        super().commit_expired()
+        self.send_heartbeat()
+
+    def send_heartbeat(self):
+        """Pass the latest heartbeat on once no transaction is open, behind the changes committed before it"""
+        if self.heartbeat is not None and not self.transactions.in_transaction:
+            self.export_stage.put((None, self.heartbeat))
+            self.heartbeat = None
+
+    def export_committed(self, change: Tuple[str, Any]):
+        table_name, rows = change
+        if table_name is None:
+            self.changes.put((self.shard, None, rows))
+        else:
+            self.export_changes(table_name, rows)
+        self.release_completed()
+
+    def export_changes(self, table_name: str, rows: List[Dict]):
+        self.changes.put((self.shard, table_name, rows))
+        # files are written by the coordinator, tombstones are held until they're in complete ones
+        if self.sweeper is not None:
+            self._unconfirmed[table_name].extend(
+                row for row in rows if row.get("change_type") == "D"
+            )
+
+    def release_completed(self):
+        """Pass the tombstones the coordinator has in complete files on to be swept.
+        A coordinator crash before then leaves them in the shard, to be exported again with the gap on restart
+        """
+        for table_name, tombstones in self._unconfirmed.items():
+            if not tombstones:
+                continue
+            completed = self.completed[table_name].value
+            released = bisect.bisect_right(
+                tombstones, completed, key=lambda row: row["change_token"]
+            )
+            if released:
+                self.sweeper.exported(table_name, tombstones[:released])
+                del tombstones[:released]
+
+    def execute(self):
+        self.prepare()
+        self.barrier.wait(ShardWorker.SEED_TIMEOUT)
+        # heartbeats are queued on the generating thread, between actions and while waiting for the next one
+        next_table, sleep = self.scheduler.next, self.scheduler.sleep
+        self.scheduler.next = lambda: self.next_table(next_table)
+        self.scheduler.sleep = lambda seconds: self.sleep(sleep, seconds)
+        self.run()
+
+
+def _run_worker(
+    config_path: str,
+    shard: int,
+    seed: int,
+    counters: Dict[Tuple[str, str], Any],
+    barrier: Any,
+    changes: Any,
+    resume: Any,
+    completed: Dict[str, Any],
+) -> None:
+    random.seed(seed)
+    imposter.seed(seed)
+    try:
+        ShardWorker(
+            config_path, shard, counters, barrier, changes, resume, completed
+        ).execute()
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        logger.exception(f"Worker {shard} failed")
+        barrier.abort()
+    finally:
+        changes.put((shard, None, None))  # no more changes from this worker
+
+
+class Coordinator:
+    """Runs generation across worker processes, each on its own shard of the database,
+    and merges their changes into a single export per table ordered by change token.
+
+    Changes for a table are only exported once every running worker has sent changes or a heartbeat past that token,
+    as each worker sends its changes in token order. Generation is paused while more than `MAX_PENDING` rows are
+    waiting on a worker, until the workers have caught up.
+    The coordinator owns the export checkpoint, the gap after it is merged from the shards before the workers start
+    """
+
+    # max number of change batches waiting on the coordinator before workers block
+    QUEUE_SIZE = 1000
+    # rows held back waiting on other workers before generation is paused, it resumes once half are exported
+    MAX_PENDING = 100000
+    # rows exported at a time when exporting the gap after the checkpoint
+    GAP_CHUNK = 10000
+
+    def __init__(self, config_path: str, workers: int):
+        self.config_path = config_path
+        self.workers = workers
+        self.cnf = Config(config_path)
+        self.tables = self.cnf.load_datasets()
+        self.checkpoint = (
+            ExportCheckpoint(self.cnf.output_path) if self.cnf.checkpoint else None
+        )
+        self.exporter = self.cnf.load_exporter(self.tables, self.file_completed)
+        # change token per table up to which all changes are in complete files, shared with the workers once started
+        self.completed_through: Dict[str, int] = {}
+        self.completed: Dict[str, Any] = {}
+
+    def file_completed(self, table_name: str, file: RollingFile, completed_through: int):
+        """Move the checkpoint on, and let the workers sweep the tombstones now in complete files
+
+        Args:
+            table_name (str): table the file belongs to
+            file (RollingFile): completed file
+            completed_through (int): change token up to which all of the table's changes are in complete files
+        """
+        if self.checkpoint is not None:
+            self.checkpoint.completed(table_name, file, completed_through)
+        if completed_through is not None:
+            self.completed_through[table_name] = max(
+                completed_through, self.completed_through.get(table_name, 0)
+            )
+            if table_name in self.completed:
+                with self.completed[table_name].get_lock():
+                    self.completed[table_name].value = self.completed_through[table_name]
+
+    def sweep_shards(self):
+        """Sweep the shards of the tombstones in complete files once the workers have stopped,
+        those in the files completed after a worker last looked are otherwise left behind
+        """
+        if self.cnf.delete_behaviour != "HARD" and not self.cnf.compact_tombstones:
+            return
+        key_fields = {
+            table.table_name: (
+                table.get_pk_field().name if table.get_pk_field() else "change_token"
+            )
+            for table in self.tables
+        }
+        for path in (
+            shard_db_path(self.cnf.db_path, shard) for shard in range(self.workers)
+        ):
+            if not Path(path).exists():
+                continue
+            db = DBConnector(path)
+            try:
+                sweeper = TombstoneSweeper(
+                    db, key_fields, compact=self.cnf.delete_behaviour == "SOFT"
+                )
+                for table_name, completed_through in self.completed_through.items():
+                    sweeper.exported(
+                        table_name, db.get_tombstones(table_name, completed_through)
+                    )
+                sweeper.sweep()
+            finally:
+                db.conn.close()
+
+    def export_gap(self):
+        """Export the changes committed after the checkpoint, merged from the shard databases in change token order.
+        Without a checkpoint to resume from, tables are checkpointed from the greatest change token across the shards
+        """
+        self.exporter.discard_incomplete()
+        resumed = self.checkpoint.load()
+        shards = [
+            DBConnector(path)
+            for path in (
+                shard_db_path(self.cnf.db_path, shard) for shard in range(self.workers)
+            )
+            if Path(path).exists()
+        ]
+        try:
+            for table in self.tables:
+                table_name = table.table_name
+                # compacted tombstones are still changes to export
+                source = (
+                    f"{table_name}_history" if self.cnf.compact_tombstones else table_name
+                )
+                sources = [
+                    db
+                    for db in shards
+                    if db.execute_sql(
+                        f"select count(1) as cnt from information_schema.tables where table_name = '{source}'",
+                        "cnt",
+                    )
+                    != "0"
+                ]
+                if not resumed:
+                    self.checkpoint.start(
+                        table_name,
+                        max(
+                            (
+                                token
+                                for token in (db.get_max_change_token(source) for db in sources)
+                                if token is not None
+                            ),
+                            default=None,
+                        ),
+                    )
+                    continue
+                change_token = self.checkpoint.change_token(table_name)
+                rows = heapq.merge(
+                    *(
+                        itertools.chain.from_iterable(db.iter_rows_since(source, change_token))
+                        for db in sources
+                    ),
+                    key=lambda row: row["change_token"],
+                )
+                for chunk in iter(lambda: list(itertools.islice(rows, Coordinator.GAP_CHUNK)), []):
+                    self.exporter.export(table_name, chunk, self.cnf.output_format)
+                self.exporter.rotate(table_name)
+        finally:
+            for db in shards:
+                db.conn.close()
+        self.checkpoint.save()
+        # changes up to the checkpoint are all in complete files
+        for table_name, checkpointed in self.checkpoint.tables.items():
+            if checkpointed["change_token"] is not None:
+                self.completed_through[table_name] = max(
+                    checkpointed["change_token"], self.completed_through.get(table_name, 0)
+                )
+
+    def execute(self):
+        self.cnf.create_output_folders([table.table_name for table in self.tables])
+        if self.checkpoint is not None:
+            self.export_gap()
+
+        context = multiprocessing.get_context("spawn")
+        # change tokens in complete files mustn't be handed out again, even if a shard has lost them
+        counters = {
+            (table.table_name, field.name): context.Value(
+                "q",
+                self.completed_through.get(table.table_name, 0) + 1
+                if field.name == "change_token"
+                else 1,
+            )
+            for table in self.tables
+            for field in table.fields
+            if field.imposter.imposter_type == ImposterType.INCREMENT
+        }
+        if self.cnf.journal:
+            counters[(ChangeJournal.TABLE_NAME, "lsn")] = context.Value("q", 1)
+        barrier = context.Barrier(self.workers)
+        changes = context.Queue(Coordinator.QUEUE_SIZE)
+        resume = context.Event()
+        resume.set()
+        self.completed = {
+            table.table_name: context.Value(
+                "q", self.completed_through.get(table.table_name, 0)
+            )
+            for table in self.tables
+        }
+        seed = int(time.time())
+
+        processes = [
+            context.Process(
+                target=_run_worker,
+                args=(
+                    self.config_path,
+                    shard,
+                    seed + shard,
+                    counters,
+                    barrier,
+                    changes,
+                    resume,
+                    self.completed,
+                ),
+            )
+            for shard in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+        # an interrupt reaches the workers too, which send their remaining changes before stopping,
+        # the merge carries on until they have rather than leaving them blocked on a full queue
+        interrupt = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        try:
+            self.merge(changes, resume)
+        finally:
+            for process in processes:
+                process.join()
+            signal.signal(signal.SIGINT, interrupt)
+            self.exporter.close()
+            self.sweep_shards()
+
+    def merge(self, changes: Any, resume: Any):
+        """Export the changes sent by the workers until they have all stopped
+
+        Args:
+            changes (Any): queue the workers send changes and heartbeats on
+            resume (Any): event cleared to pause generation while too many rows are held back
+        """
+        # highest change token received per table from each running worker, by its changes or heartbeats
+        watermarks = {
+            table.table_name: {shard: 0 for shard in range(self.workers)}
+            for table in self.tables
+        }
+        pending = {table.table_name: [] for table in self.tables}
+        pending_rows = 0
+        order = itertools.count()  # tie breaker, keeping rows with the same token in arrival order
+        running = set(range(self.workers))
+
+        while running:
+            shard, table_name, rows = changes.get()
+
+            if table_name is None and rows is None:
+                running.discard(shard)
+                for table_watermarks in watermarks.values():
+                    table_watermarks.pop(shard, None)
+                table_names = list(pending)
+            elif table_name is None:
+                for name, change_token in rows.items():
+                    watermarks[name][shard] = max(watermarks[name][shard], change_token)
+                table_names = list(pending)
+            else:
+                for row in rows:
+                    heapq.heappush(
+                        pending[table_name], (row["change_token"], next(order), row)
+                    )
+                pending_rows += len(rows)
+                watermarks[table_name][shard] = rows[-1]["change_token"]
+                table_names = [table_name]
+
+            for name in table_names:
+                limit = min(watermarks[name].values(), default=float("inf"))
+                released = []
+                while pending[name] and pending[name][0][0] <= limit:
+                    released.append(heapq.heappop(pending[name])[2])
+                if released:
+                    pending_rows -= len(released)
+                    self.exporter.export(name, released, self.cnf.output_format)
+
+            if pending_rows > Coordinator.MAX_PENDING and resume.is_set():
+                logger.info(f"{pending_rows} rows waiting on other workers, pausing generation")
+                resume.clear()
+            elif pending_rows <= Coordinator.MAX_PENDING // 2 and not resume.is_set():
+                resume.set()